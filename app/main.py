@@ -8,6 +8,7 @@ FastAPI application with:
 - Image upload with thumbnails
 - Monetization (boost, VIP)
 """
+import asyncio
 from contextlib import asynccontextmanager
 from pathlib import Path
 import logging
@@ -19,6 +20,7 @@ from fastapi.staticfiles import StaticFiles
 from app.config import settings
 from app.database import init_db, close_db
 from app.routers import auth, users, listings, categories, chat, monetization
+from app.services.listing_service import views_flush_loop, flush_view_counts
 
 # Configure logging
 logging.basicConfig(
@@ -44,10 +46,15 @@ async def lifespan(app: FastAPI):
     # Initialize database
     await init_db()
     logger.info("✅ Database initialized")
-    
+
+    # Background flusher for batched view counters
+    views_task = asyncio.create_task(views_flush_loop())
+
     yield
-    
+
     # Cleanup
+    views_task.cancel()
+    await flush_view_counts()  # drain whatever is still pending
     await close_db()
     logger.info("👋 NellX API shutdown complete")
 
@@ -163,6 +163,7 @@ class ListingImage(Base):
     # === URLs ===
     url = Column(String(500), nullable=False)  # Full image URL
     thumbnail_url = Column(String(500))        # Compressed thumbnail (300px)
+    file_key = Column(String(300))             # Relative storage key, e.g. "listings/abc.webp"
     
     # === Ordering ===
     sort_order = Column(Integer, default=0)
@@ -219,6 +219,7 @@ async def upload_image(
             url=result["url"],
             thumbnail_url=result.get("thumbnail_url"),
             is_primary=is_primary,
+            file_key=result.get("file_key"),
         )
         
         return {
@@ -234,6 +235,49 @@ async def upload_image(
         )
 
 
+@router.post("/{listing_id}/images/batch")
+async def upload_images_batch(
+    listing_id: int,
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Upload several images for a listing in one request.
+
+    Files are encoded concurrently and inserted in a single transaction,
+    avoiding one request + one INSERT round-trip per photo.
+    """
+    service = ListingService(db)
+
+    # Verify ownership
+    listing = await service.get_by_id(listing_id)
+    if not listing or listing.owner_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Объявление не найдено или нет прав"
+        )
+
+    try:
+        results = await file_service.save_images_batch(files, folder="listings")
+        images = await service.add_images_batch(listing_id, results)
+
+        return [
+            {
+                "id": image.id,
+                "url": result["url"],
+                "thumbnail_url": result.get("thumbnail_url"),
+            }
+            for image, result in zip(images, results)
+        ]
+
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+
 @router.post("/{listing_id}/boost")
 async def boost_listing(
     listing_id: int,
@@ -2,13 +2,15 @@
 File upload service - handles image uploads to local disk or S3.
 Replaces base64 image_data storage with proper file management.
 """
+import asyncio
+import hashlib
 import os
 import uuid
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 from fastapi import UploadFile
-from PIL import Image
+from PIL import Image, ImageOps
 import aiofiles
 
 from app.config import settings
@@ -31,10 +33,16 @@ class FileService:
     MAX_SIZE_BYTES = settings.MAX_IMAGE_SIZE_MB * 1024 * 1024
     THUMBNAIL_SIZE = (300, 300)
     
+    # Dedup cache: content hash -> stored result dict.
+    # Re-uploads of the same bytes (common for avatars/listing photos)
+    # skip the whole Pillow pipeline. Per-worker, bounded below.
+    HASH_CACHE_MAX = 10_000
+
     def __init__(self):
         self.storage_type = settings.STORAGE_TYPE
         self.upload_dir = Path(settings.UPLOAD_DIR)
         self.base_url = settings.BASE_URL
+        self._hash_cache: dict = {}
     
     async def save_image(
         self,
@@ -60,26 +68,91 @@ class FileService:
                 "height": 600
             }
         """
-        # Validate extension
+        content = await self._read_validated(file)
+
+        # Dedup: identical bytes were already stored, reuse their URLs
+        content_hash = self._hash_content(content, folder, generate_thumbnail)
+        cached = self._hash_cache.get(content_hash)
+        if cached is not None:
+            return dict(cached)
+
+        # Generate unique filename
+        filename = f"{uuid.uuid4().hex}.webp"
+
+        if self.storage_type == "local":
+            result = await self._save_local(content, folder, filename, generate_thumbnail)
+        else:
+            result = await self._save_s3(content, folder, filename, generate_thumbnail)
+
+        self._remember(content_hash, result)
+        return result
+
+    async def save_images_batch(
+        self,
+        files: List[UploadFile],
+        folder: str = "listings",
+        generate_thumbnail: bool = True
+    ) -> List[dict]:
+        """
+        Save several uploaded images at once.
+
+        All files are validated up front, then encoded concurrently
+        (each encode runs in a worker thread). Results are returned in
+        the order the files were given.
+        """
+        contents = [await self._read_validated(file) for file in files]
+
+        if self.storage_type == "local":
+            save = self._save_local
+        else:
+            save = self._save_s3
+
+        hashes = [
+            self._hash_content(content, folder, generate_thumbnail)
+            for content in contents
+        ]
+        results: List[Optional[dict]] = [
+            dict(cached) if (cached := self._hash_cache.get(h)) is not None else None
+            for h in hashes
+        ]
+
+        fresh = [i for i, result in enumerate(results) if result is None]
+        if fresh:
+            saved = await asyncio.gather(*[
+                save(contents[i], folder, f"{uuid.uuid4().hex}.webp", generate_thumbnail)
+                for i in fresh
+            ])
+            for i, result in zip(fresh, saved):
+                self._remember(hashes[i], result)
+                results[i] = result
+
+        return results
+
+    @staticmethod
+    def _hash_content(content: bytes, folder: str, generate_thumbnail: bool) -> str:
+        """Content hash used for upload dedup"""
+        h = hashlib.blake2b(content, digest_size=16).hexdigest()
+        return f"{folder}:{int(generate_thumbnail)}:{h}"
+
+    def _remember(self, content_hash: str, result: dict):
+        """Record a stored upload in the dedup cache (bounded)"""
+        if len(self._hash_cache) >= self.HASH_CACHE_MAX:
+            self._hash_cache.clear()
+        self._hash_cache[content_hash] = dict(result)
+
+    async def _read_validated(self, file: UploadFile) -> bytes:
+        """Validate extension/size and return the file content"""
         ext = self._get_extension(file.filename)
         if ext not in self.ALLOWED_EXTENSIONS:
             raise ValueError(f"Invalid file type. Allowed: {', '.join(self.ALLOWED_EXTENSIONS)}")
-        
-        # Read file content
+
         content = await file.read()
-        
-        # Validate size
+
         if len(content) > self.MAX_SIZE_BYTES:
             raise ValueError(f"File too large. Max size: {settings.MAX_IMAGE_SIZE_MB}MB")
-        
-        # Generate unique filename
-        filename = f"{uuid.uuid4()}.webp"
-        
-        if self.storage_type == "local":
-            return await self._save_local(content, folder, filename, generate_thumbnail)
-        else:
-            return await self._save_s3(content, folder, filename, generate_thumbnail)
-    
+
+        return content
+
     async def _save_local(
         self,
         content: bytes,
@@ -87,34 +160,67 @@ class FileService:
         filename: str,
         generate_thumbnail: bool
     ) -> dict:
-        """Save to local filesystem"""
-        folder_path = self.upload_dir / folder
+        """Save to local filesystem (Pillow work runs in a worker thread)"""
+        return await asyncio.to_thread(
+            self._process_local, content, folder, filename, generate_thumbnail
+        )
+
+    def _process_local(
+        self,
+        content: bytes,
+        folder: str,
+        filename: str,
+        generate_thumbnail: bool
+    ) -> dict:
+        """Decode, convert and store an image on the local filesystem"""
+        # Shard into <folder>/ab/cd/ by filename prefix so a single
+        # directory never accumulates an unbounded number of files
+        # (directory lookups degrade past ~100k entries on ext4/NFS).
+        subdir = f"{folder}/{filename[:2]}/{filename[2:4]}"
+        folder_path = self.upload_dir / subdir
         folder_path.mkdir(parents=True, exist_ok=True)
-        
+
         file_path = folder_path / filename
-        
+
         # Process image with Pillow
         from io import BytesIO
         img = Image.open(BytesIO(content))
-        
-        # Convert to RGB if necessary (for WebP)
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if 'A' in img.mode else None)
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        width, height = img.size
-        
-        # Save optimized image
-        img.save(file_path, "WEBP", quality=85, optimize=True)
-        file_size = file_path.stat().st_size
+
+        if img.format == "WEBP":
+            # Already a valid WebP under the size limit - persist the
+            # original bytes as-is. Image.open is lazy, so reading the
+            # size here doesn't decode any pixels; only the thumbnail
+            # path below touches pixel data.
+            width, height = img.size
+            file_path.write_bytes(content)
+            file_size = len(content)
+        else:
+            # Apply EXIF orientation once at ingest. WebP output drops
+            # the EXIF block anyway, so without this phone-camera shots
+            # would be stored rotated.
+            img = ImageOps.exif_transpose(img)
+            width, height = img.size
+
+            # Convert to RGB if necessary (for WebP).
+            # Alpha inputs are composited over white in one fused C pass
+            # instead of allocating + filling a separate background image.
+            if img.mode in ('RGBA', 'LA', 'P'):
+                if img.mode != 'RGBA':
+                    img = img.convert('RGBA')
+                img = Image.alpha_composite(
+                    Image.new('RGBA', img.size, (255, 255, 255, 255)),
+                    img
+                ).convert('RGB')
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+
+            # Save optimized image
+            img.save(file_path, "WEBP", quality=85, optimize=True)
+            file_size = file_path.stat().st_size
         
         result = {
-            "url": f"{self.base_url}/uploads/{folder}/{filename}",
+            "url": f"{self.base_url}/uploads/{subdir}/{filename}",
+            "file_key": f"{subdir}/{filename}",
             "filename": filename,
             "size": file_size,
             "width": width,
@@ -130,7 +236,7 @@ class FileService:
             thumb_img.thumbnail(self.THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
             thumb_img.save(thumb_path, "WEBP", quality=80, optimize=True)
             
-            result["thumbnail_url"] = f"{self.base_url}/uploads/{folder}/{thumb_filename}"
+            result["thumbnail_url"] = f"{self.base_url}/uploads/{subdir}/{thumb_filename}"
         
         logger.info(f"Saved image: {file_path}")
         return result
@@ -156,24 +262,30 @@ class FileService:
         # )
         raise NotImplementedError("S3 storage not yet implemented. Set STORAGE_TYPE=local")
     
-    async def delete_image(self, url: str) -> bool:
-        """Delete an image by its URL"""
-        if self.storage_type == "local":
-            # Extract path from URL
-            path = url.replace(f"{self.base_url}/", "")
-            file_path = Path(path)
-            
-            if file_path.exists():
-                file_path.unlink()
-                logger.info(f"Deleted image: {file_path}")
-                
-                # Also delete thumbnail
-                thumb_path = file_path.parent / f"thumb_{file_path.name}"
-                if thumb_path.exists():
-                    thumb_path.unlink()
-                
-                return True
-        return False
+    async def delete_image(self, file_key: str) -> bool:
+        """
+        Delete an image (and its thumbnail) by its stored file key,
+        e.g. "listings/abc123.webp".
+
+        The key is validated against path traversal, and unlink uses
+        missing_ok so no exists() stat round-trip is needed.
+        """
+        if self.storage_type != "local":
+            return False
+
+        key = Path(file_key)
+        if not file_key or key.is_absolute() or ".." in key.parts:
+            raise ValueError(f"Invalid file key: {file_key!r}")
+
+        file_path = self.upload_dir / key
+        file_path.unlink(missing_ok=True)
+
+        # Also delete thumbnail
+        thumb_path = file_path.parent / f"thumb_{file_path.name}"
+        thumb_path.unlink(missing_ok=True)
+
+        logger.info(f"Deleted image: {file_path}")
+        return True
     
     @staticmethod
     def _get_extension(filename: str) -> str:
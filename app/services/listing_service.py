@@ -1,16 +1,75 @@
 """
 Listing service - business logic for marketplace posts.
 """
+import asyncio
+import logging
 from datetime import datetime, timedelta
-from typing import Optional, List, Tuple
-from sqlalchemy import select, func, or_, and_, desc
-from sqlalchemy.orm import selectinload
+from time import monotonic
+from typing import Dict, Optional, List, Tuple
+from sqlalchemy import select, func, or_, and_, desc, update
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.database import AsyncSessionLocal
 from app.models.listing import Listing, ListingImage, ListingStatus, ListingType
 from app.models.user import User
 from app.schemas.listing import ListingCreate, ListingUpdate
 
+logger = logging.getLogger(__name__)
+
+# === Feed first-page cache ===
+# Page 1 with no search query is by far the hottest read path.
+# Cache results per worker for a few seconds; any write that can change
+# feed ordering bumps the generation counter to invalidate all entries.
+FEED_CACHE_TTL = 20  # seconds
+
+_feed_cache: dict = {}
+_feed_cache_generation = 0
+
+
+def invalidate_feed_cache():
+    """Drop all cached feed pages (called after create/bump/boost/etc.)"""
+    global _feed_cache_generation
+    _feed_cache_generation += 1
+    _feed_cache.clear()
+
+
+# === View counter batching ===
+# Detail-page views are far too frequent for one UPDATE per view.
+# Counts accumulate in memory and a background task flushes them
+# as atomic "views_count = views_count + delta" updates.
+VIEWS_FLUSH_INTERVAL = 10  # seconds
+
+_pending_views: Dict[int, int] = {}
+
+
+async def flush_view_counts():
+    """Write accumulated view counts to the database"""
+    if not _pending_views:
+        return
+
+    counts = dict(_pending_views)
+    _pending_views.clear()
+
+    async with AsyncSessionLocal() as session:
+        for listing_id, delta in counts.items():
+            await session.execute(
+                update(Listing)
+                .where(Listing.id == listing_id)
+                .values(views_count=Listing.views_count + delta)
+            )
+        await session.commit()
+
+
+async def views_flush_loop():
+    """Background task: periodically flush view counters"""
+    while True:
+        await asyncio.sleep(VIEWS_FLUSH_INTERVAL)
+        try:
+            await flush_view_counts()
+        except Exception as e:
+            logger.error(f"Failed to flush view counts: {e}")
+
 
 class ListingService:
     """
@@ -50,7 +109,9 @@ class ListingService:
         self.db.add(listing)
         await self.db.flush()
         await self.db.refresh(listing)
-        
+
+        invalidate_feed_cache()
+
         return listing
     
     async def get_by_id(self, listing_id: int) -> Optional[Listing]:
@@ -84,7 +145,9 @@ class ListingService:
             setattr(listing, field, value)
         
         listing.updated_at = datetime.utcnow()
-        
+
+        invalidate_feed_cache()
+
         return listing
     
     async def delete(self, listing_id: int, owner_id: int) -> bool:
@@ -95,6 +158,7 @@ class ListingService:
             return False
         
         await self.db.delete(listing)
+        invalidate_feed_cache()
         return True
     
     async def add_image(
@@ -102,7 +166,8 @@ class ListingService:
         listing_id: int,
         url: str,
         thumbnail_url: Optional[str] = None,
-        is_primary: bool = False
+        is_primary: bool = False,
+        file_key: Optional[str] = None
     ) -> ListingImage:
         """Add image to listing"""
         # If primary, unset other primaries
@@ -127,14 +192,51 @@ class ListingService:
             listing_id=listing_id,
             url=url,
             thumbnail_url=thumbnail_url,
+            file_key=file_key,
             is_primary=is_primary,
             sort_order=max_order + 1,
         )
         
         self.db.add(image)
         await self.db.flush()
-        
+
         return image
+
+    async def add_images_batch(
+        self,
+        listing_id: int,
+        items: List[dict]
+    ) -> List[ListingImage]:
+        """
+        Add several images to a listing in one transaction.
+
+        One SELECT for the current max sort_order, then a single flush
+        for all rows — instead of a SELECT+INSERT round-trip per image.
+        """
+        result = await self.db.execute(
+            select(func.max(ListingImage.sort_order))
+            .where(ListingImage.listing_id == listing_id)
+        )
+        max_order = result.scalar() or -1
+
+        images = [
+            ListingImage(
+                listing_id=listing_id,
+                url=item["url"],
+                thumbnail_url=item.get("thumbnail_url"),
+                file_key=item.get("file_key"),
+                file_size=item.get("size"),
+                width=item.get("width"),
+                height=item.get("height"),
+                sort_order=max_order + 1 + i,
+            )
+            for i, item in enumerate(items)
+        ]
+
+        self.db.add_all(images)
+        await self.db.flush()
+
+        return images
     
     async def get_feed(
         self,
@@ -153,11 +255,23 @@ class ListingService:
         Order: boosted listings first, then by bumped_at (most recent).
         This allows users to "bump" their posts to the top.
         """
+        # Serve the hot first page from cache when there's no search query
+        cache_key = None
+        if page == 1 and not search:
+            cache_key = (per_page, category_id, city, listing_type, min_price, max_price)
+            cached = _feed_cache.get(cache_key)
+            if cached and cached[0] > monotonic() and cached[1] == _feed_cache_generation:
+                return cached[2], cached[3]
+
+        # images (collection) stays on selectinload; owner/category are
+        # many-to-one, so joinedload folds them into the main query and
+        # saves one IN-query round-trip each.
         query = (
             select(Listing)
             .options(
                 selectinload(Listing.images),
-                selectinload(Listing.owner)
+                joinedload(Listing.owner),
+                joinedload(Listing.category)
             )
             .where(Listing.status == ListingStatus.ACTIVE)
         )
@@ -200,8 +314,16 @@ class ListingService:
         query = query.offset(offset).limit(per_page)
         
         result = await self.db.execute(query)
-        listings = result.scalars().all()
-        
+        listings = result.unique().scalars().all()
+
+        if cache_key is not None:
+            _feed_cache[cache_key] = (
+                monotonic() + FEED_CACHE_TTL,
+                _feed_cache_generation,
+                listings,
+                total,
+            )
+
         return listings, total
     
     async def get_user_listings(
@@ -247,7 +369,9 @@ class ListingService:
         listing.boost_level = boost_level
         listing.boosted_until = datetime.utcnow() + timedelta(hours=duration_hours)
         listing.bumped_at = datetime.utcnow()  # Also bump to top
-        
+
+        invalidate_feed_cache()
+
         return listing
     
     async def bump_listing(self, listing_id: int, owner_id: int) -> Optional[Listing]:
@@ -261,17 +385,17 @@ class ListingService:
             return None
         
         listing.bumped_at = datetime.utcnow()
-        
+
+        invalidate_feed_cache()
+
         return listing
     
     async def increment_views(self, listing_id: int):
-        """Increment view counter"""
-        await self.db.execute(
-            select(Listing)
-            .where(Listing.id == listing_id)
-        )
-        # Use raw SQL for atomic increment
-        # In production, consider using Redis for high-frequency counters
-        listing = await self.get_by_id(listing_id)
-        if listing:
-            listing.views_count += 1
+        """
+        Record a view.
+
+        Counts are accumulated in memory and flushed to the database
+        in batches by views_flush_loop - no per-view transaction, and
+        the increment itself is applied atomically at flush time.
+        """
+        _pending_views[listing_id] = _pending_views.get(listing_id, 0) + 1
@@ -1,10 +1,178 @@
+import asyncio
+import json
+import sqlite3
 import aiosqlite
 import logging
+from time import monotonic
 
 DB_NAME = "bot.db"
 
+# UPDATE/DELETE ... RETURNING появились в SQLite 3.35
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35)
+
+# Shared long-lived connection. Opening a fresh connection per call
+# spawns a worker thread, re-opens the file and re-parses the schema
+# every time; instead the connection is opened once and reused by every
+# helper. Access is serialized by a single lock so multi-statement
+# helpers stay atomic with respect to each other.
+_conn: aiosqlite.Connection | None = None
+_db_lock = asyncio.Lock()
+
+# Applied once when the shared connection is opened. WAL lets readers
+# run alongside the writer and synchronous=NORMAL fsyncs only at
+# checkpoint instead of on every commit.
+_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "cache_size=-65536",
+    "mmap_size=268435456",
+    "busy_timeout=5000",
+)
+
+
+class _SharedDB:
+    """Async context manager handing out the shared connection.
+
+    Drop-in replacement for ``aiosqlite.connect(DB_NAME)`` call sites.
+    """
+
+    async def __aenter__(self) -> aiosqlite.Connection:
+        global _conn
+        await _db_lock.acquire()
+        try:
+            if _conn is None:
+                # cached_statements: sqlite3 кэширует план по тексту
+                # запроса — SQL-константы ниже попадают в кэш навсегда
+                _conn = await aiosqlite.connect(DB_NAME, cached_statements=256)
+                _conn.row_factory = aiosqlite.Row
+                if not DB_NAME.startswith(":"):  # WAL makes no sense in-memory
+                    for pragma in _PRAGMAS:
+                        await _conn.execute(f"PRAGMA {pragma}")
+                    # Подтверждаем, что WAL реально включился (на сетевых
+                    # ФС SQLite может молча откатиться к rollback-журналу)
+                    async with _conn.execute("PRAGMA journal_mode") as cursor:
+                        mode = (await cursor.fetchone())[0]
+                    if mode != "wal":
+                        logging.warning(f"journal_mode is {mode!r}, expected 'wal'")
+            return _conn
+        except BaseException:
+            _db_lock.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is not None and _conn is not None:
+                # Don't leave a half-done transaction behind for the
+                # next helper to accidentally commit.
+                await _conn.rollback()
+        finally:
+            _db_lock.release()
+        return False
+
+
+def get_db() -> _SharedDB:
+    """Get the shared database connection (context manager)"""
+    return _SharedDB()
+
+
+async def close_db():
+    """Close the shared connection (call on shutdown)"""
+    global _conn, _writer_task
+    if _writer_task is not None:
+        # Дать писателю дослать уже поставленные в очередь записи
+        if _write_q is not None:
+            await _write_q.join()
+        _writer_task.cancel()
+        _writer_task = None
+    if _conn is not None:
+        try:
+            # Обновить статистику планировщика по изменившимся таблицам,
+            # чтобы следующий запуск сразу выбирал хорошие планы JOIN'ов
+            await _conn.execute("PRAGMA analysis_limit=400")
+            await _conn.execute("PRAGMA optimize")
+        except Exception as e:
+            logging.warning(f"PRAGMA optimize failed on close: {e}")
+        await _conn.close()
+        _conn = None
+
+
+# === TTL-кэши для read-mostly запросов ===
+# get_user / get_spam_settings дергаются на каждое входящее сообщение,
+# а меняются редко. Попадание в кэш обходит и executor-поток aiosqlite,
+# и спуск по B-дереву. Пишущие функции инвалидируют соответствующий ключ.
+_CACHE_TTL = 30  # секунд
+
+_user_cache: dict = {}
+_spam_cache: dict = {}
+_categories_cache = None
+
+
+def _invalidate_user(telegram_id: int):
+    _user_cache.pop(telegram_id, None)
+
+
+# === Очередь писателя ===
+# Одиночные записи идут через одну корутину-писателя: очередь даёт
+# детерминированный порядок вместо busy-wait на блокировке SQLite,
+# а читатели продолжают ходить к базе напрямую (WAL им это позволяет).
+_write_q = None
+_writer_task = None
+
+
+# Сколько записей писатель может слить в одну транзакцию
+_WRITE_BATCH_MAX = 128
+
+
+async def _writer_loop():
+    while True:
+        batch = [await _write_q.get()]
+        # Под нагрузкой очередь копится — сливаем накопившееся в одну
+        # транзакцию: один fsync на пачку вместо одного на запись
+        while len(batch) < _WRITE_BATCH_MAX and not _write_q.empty():
+            batch.append(_write_q.get_nowait())
+        try:
+            async with get_db() as db:
+                await db.execute("BEGIN")
+                committed = []
+                for sql, params, fut in batch:
+                    try:
+                        await db.execute(sql, params)
+                    except Exception as e:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    else:
+                        committed.append(fut)
+                await db.commit()
+            # Будущие резолвим только после успешного COMMIT
+            for fut in committed:
+                if not fut.done():
+                    fut.set_result(None)
+        except Exception as e:
+            for _, _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        finally:
+            for _ in batch:
+                _write_q.task_done()
+
+
+async def write(sql: str, params=()):
+    """Выполнить одиночный пишущий запрос через очередь писателя"""
+    global _write_q, _writer_task
+    if _write_q is None:
+        _write_q = asyncio.Queue()
+        _writer_task = asyncio.create_task(_writer_loop())
+    fut = asyncio.get_running_loop().create_future()
+    await _write_q.put((sql, params, fut))
+    await fut
+
+
 async def create_tables():
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
+        # All CREATE TABLE / migration statements run in one
+        # transaction: one fsync at the end instead of one per commit.
+        await db.execute("BEGIN")
         # Users table
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -21,13 +189,26 @@ async def create_tables():
             )
         """)
         
-        # Verification codes table
-        await db.execute("""
+        # Verification codes table.
+        # WITHOUT ROWID: данные лежат прямо в B-дереве первичного ключа —
+        # один спуск по дереву на запрос вместо двух (индекс -> rowid -> строка)
+        await _create_table_without_rowid(db, "verification_codes", """
             CREATE TABLE IF NOT EXISTS verification_codes (
                 phone TEXT PRIMARY KEY,
                 code TEXT,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
+            ) WITHOUT ROWID
+        """)
+
+        # Коды подтверждения из бота: нормальная схема вместо
+        # префиксов "code_"/"verified_" в verification_codes.phone
+        await _create_table_without_rowid(db, "code_challenges", """
+            CREATE TABLE IF NOT EXISTS code_challenges (
+                code TEXT PRIMARY KEY,
+                user_id INTEGER,
+                state TEXT DEFAULT 'pending', -- 'pending' | 'verified'
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            ) WITHOUT ROWID
         """)
         
         # Templates table
@@ -58,20 +239,39 @@ async def create_tables():
                 FOREIGN KEY(template_id) REFERENCES templates(id)
             )
         """)
+
+        # Нормализованные целевые чаты рассылок: одна строка на чат
+        # вместо JSON-списка, который парсится при каждом чтении
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS scheduled_task_groups (
+                task_id INTEGER,
+                chat_id TEXT, -- int id или "chat_id:topic_id"
+                FOREIGN KEY(task_id) REFERENCES scheduled_tasks(id)
+            )
+        """)
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_task_groups_task ON scheduled_task_groups(task_id)"
+        )
         # миграция для старых таблиц без новых колонок
-        await _ensure_column(db, "scheduled_tasks", "start_time", "TEXT")
-        await _ensure_column(db, "scheduled_tasks", "end_time", "TEXT")
-        await _ensure_column(db, "scheduled_tasks", "interval_minutes", "INTEGER")
-        await _ensure_column(db, "scheduled_tasks", "last_run", "TIMESTAMP")
-        await _ensure_column(db, "scheduled_tasks", "is_active", "BOOLEAN DEFAULT 1")
-        
+        await _ensure_columns(db, "scheduled_tasks", {
+            "start_time": "TEXT",
+            "end_time": "TEXT",
+            "interval_minutes": "INTEGER",
+            "last_run": "TIMESTAMP",
+            "is_active": "BOOLEAN DEFAULT 1",
+        })
+
         # Migration for templates
-        await _ensure_column(db, "templates", "caption", "TEXT")
-        await _ensure_column(db, "templates", "entities", "TEXT")
-        await _ensure_column(db, "templates", "name", "TEXT")
-        await _ensure_column(db, "users", "display_name", "TEXT")
-        await _ensure_column(db, "users", "username", "TEXT")
-        await _ensure_column(db, "users", "phone", "TEXT")
+        await _ensure_columns(db, "templates", {
+            "caption": "TEXT",
+            "entities": "TEXT",
+            "name": "TEXT",
+        })
+        await _ensure_columns(db, "users", {
+            "display_name": "TEXT",
+            "username": "TEXT",
+            "phone": "TEXT",
+        })
         
         # Market rates table
         await db.execute("""
@@ -85,6 +285,16 @@ async def create_tables():
             )
         """)
 
+        # Скользящий агрегат курсов за 24 часа: поддерживается
+        # инкрементально при вставке, чтение — O(1) вместо скана
+        await _create_table_without_rowid(db, "rates_agg", """
+            CREATE TABLE IF NOT EXISTS rates_agg (
+                currency_pair TEXT PRIMARY KEY,
+                sum_buy REAL DEFAULT 0,
+                n INTEGER DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+
         # Monitored chats table
         await db.execute("""
             CREATE TABLE IF NOT EXISTS monitored_chats (
@@ -96,7 +306,6 @@ async def create_tables():
             )
         """)
         
-        await db.commit()
         # Spam settings table
         await db.execute("""
             CREATE TABLE IF NOT EXISTS spam_settings (
@@ -111,7 +320,7 @@ async def create_tables():
         """)
 
         # Banned users challenge table
-        await db.execute("""
+        await _create_table_without_rowid(db, "banned_users", """
             CREATE TABLE IF NOT EXISTS banned_users (
                 user_id INTEGER,
                 chat_id INTEGER,
@@ -119,21 +328,22 @@ async def create_tables():
                 correct_answer INTEGER,
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                 PRIMARY KEY (user_id, chat_id)
-            )
+            ) WITHOUT ROWID
         """)
         
-        await db.commit()
-        await db.commit()
-        
         # Migrations for spam_settings
-        await _ensure_column(db, "spam_settings", "flood_max_msgs", "INTEGER DEFAULT 0")
-        await _ensure_column(db, "spam_settings", "flood_window", "INTEGER DEFAULT 60")
-        await _ensure_column(db, "spam_settings", "flood_mute_time", "INTEGER DEFAULT 300")
+        await _ensure_columns(db, "spam_settings", {
+            "flood_max_msgs": "INTEGER DEFAULT 0",
+            "flood_window": "INTEGER DEFAULT 60",
+            "flood_mute_time": "INTEGER DEFAULT 300",
+        })
 
         # P2P Exchange Tables
-        await _ensure_column(db, "users", "role", "TEXT DEFAULT 'client'")
-        await _ensure_column(db, "users", "rating", "REAL DEFAULT 5.0")
-        await _ensure_column(db, "users", "deals_count", "INTEGER DEFAULT 0")
+        await _ensure_columns(db, "users", {
+            "role": "TEXT DEFAULT 'client'",
+            "rating": "REAL DEFAULT 5.0",
+            "deals_count": "INTEGER DEFAULT 0",
+        })
 
         await db.execute("""
             CREATE TABLE IF NOT EXISTS orders (
@@ -164,8 +374,10 @@ async def create_tables():
                 FOREIGN KEY(exchanger_id) REFERENCES users(telegram_id)
             )
         """)
-        await _ensure_column(db, "bids", "status", "TEXT DEFAULT 'pending'")
-        await _ensure_column(db, "bids", "message_id", "INTEGER")
+        await _ensure_columns(db, "bids", {
+            "status": "TEXT DEFAULT 'pending'",
+            "message_id": "INTEGER",
+        })
 
         await db.execute("""
             CREATE TABLE IF NOT EXISTS market_posts (
@@ -182,7 +394,7 @@ async def create_tables():
                 FOREIGN KEY(user_id) REFERENCES users(telegram_id)
         )
         """)
-        await _ensure_column(db, "market_posts", "image_data", "TEXT")
+        await _ensure_columns(db, "market_posts", {"image_data": "TEXT"})
 
         await db.execute("""
             CREATE TABLE IF NOT EXISTS categories (
@@ -193,10 +405,11 @@ async def create_tables():
             )
         """)
 
-        # Add category to market_posts
-        await _ensure_column(db, "market_posts", "category", "TEXT")
-        # Add title to market_posts for new form structure
-        await _ensure_column(db, "market_posts", "title", "TEXT")
+        # Add category and title to market_posts for new form structure
+        await _ensure_columns(db, "market_posts", {
+            "category": "TEXT",
+            "title": "TEXT",
+        })
 
         # Web accounts for login/password auth
         await db.execute("""
@@ -282,8 +495,25 @@ async def create_tables():
             )
         """)
 
-        # Avatar column for web_accounts
-        await _ensure_column(db, "web_accounts", "avatar_url", "TEXT")
+        # Avatar column for web_accounts + предвычисленный nickname_lower:
+        # WHERE LOWER(nickname) = LOWER(?) не использует индекс и сканирует
+        # всю таблицу на каждом логине/регистрации
+        # phone_normalized аналогично избавляет is_phone_registered от
+        # тройного REPLACE() по каждой строке
+        await _ensure_columns(db, "web_accounts", {
+            "avatar_url": "TEXT",
+            "original_avatar_url": "TEXT",
+            "nickname_lower": "TEXT",
+            "phone_normalized": "TEXT",
+        })
+        await db.execute(
+            "UPDATE web_accounts SET nickname_lower = LOWER(nickname) WHERE nickname_lower IS NULL"
+        )
+        await db.execute(
+            """UPDATE web_accounts
+               SET phone_normalized = REPLACE(REPLACE(REPLACE(phone, '+', ''), ' ', ''), '-', '')
+               WHERE phone IS NOT NULL AND phone_normalized IS NULL"""
+        )
 
         await db.execute("""
             CREATE TABLE IF NOT EXISTS seller_codes (
@@ -353,37 +583,82 @@ async def create_tables():
             )
         """)
 
-        await db.commit()
+        # Индексы на горячих WHERE/JOIN колонках — без них SQLite
+        # сканирует всю таблицу на каждый запрос по FK
+        for index_sql in (
+            "CREATE INDEX IF NOT EXISTS idx_monitored_chats_user ON monitored_chats(user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_user_active ON scheduled_tasks(user_id, is_active)",
+            "CREATE INDEX IF NOT EXISTS idx_orders_user_status ON orders(user_id, status)",
+            "CREATE INDEX IF NOT EXISTS idx_bids_order ON bids(order_id)",
+            "CREATE INDEX IF NOT EXISTS idx_bids_exchanger ON bids(exchanger_id)",
+            "CREATE INDEX IF NOT EXISTS idx_market_posts_user ON market_posts(user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_market_rates_timestamp ON market_rates(timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_market_rates_pair_ts ON market_rates(currency_pair, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_banned_users_chat ON banned_users(chat_id)",
+            "CREATE INDEX IF NOT EXISTS idx_wa_phone_norm ON web_accounts(phone_normalized)",
+            "CREATE INDEX IF NOT EXISTS idx_wa_tg ON web_accounts(telegram_id) WHERE telegram_id IS NOT NULL",
+            # Частичные индексы: ищутся только непогашенные коды,
+            # погасшая история не раздувает дерево
+            "CREATE INDEX IF NOT EXISTS idx_wvc_code_unverified ON web_verification_codes(code) WHERE verified = 0",
+            "CREATE INDEX IF NOT EXISTS idx_seller_codes_unused ON seller_codes(code) WHERE used = 0",
+            "CREATE INDEX IF NOT EXISTS idx_bvc_code_unused ON bot_verification_codes(code) WHERE used = 0",
+        ):
+            await db.execute(index_sql)
+
+        await db.execute("COMMIT")
+
+        # Уникальность ника без учёта регистра должна жить в самой базе —
+        # иначе две конкурентные регистрации проходят проверку обе.
+        # На легаси-базах с дубликатами откатываемся на обычный индекс
+        try:
+            await db.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_wa_nick_lower ON web_accounts(nickname_lower)"
+            )
+        except sqlite3.Error:
+            logging.warning("Duplicate nicknames prevent unique index; creating plain index")
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_wa_nick_lower ON web_accounts(nickname_lower)"
+            )
+
+        # Разовый прогон статистики на старте (см. также close_db)
+        await db.execute("PRAGMA analysis_limit=400")
+        await db.execute("PRAGMA optimize")
+
         logging.info("Tables created successfully")
 
 async def add_user(telegram_id: int, language: str, username: str = None):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-            INSERT OR IGNORE INTO users (telegram_id, language)
-            VALUES (?, ?)
-        """, (telegram_id, language))
-        await db.execute("""
-            UPDATE users SET language = ? WHERE telegram_id = ?
-        """, (language, telegram_id))
-        # Save username if provided
+    async with get_db() as db:
+        # Один UPSERT вместо INSERT OR IGNORE + UPDATE
+        # (как в update_spam_settings)
         if username:
             await db.execute("""
-                UPDATE users SET username = ? WHERE telegram_id = ?
-            """, (username, telegram_id))
+                INSERT INTO users (telegram_id, language, username)
+                VALUES (?, ?, ?)
+                ON CONFLICT(telegram_id) DO UPDATE SET
+                    language = excluded.language,
+                    username = excluded.username
+            """, (telegram_id, language, username))
+        else:
+            await db.execute("""
+                INSERT INTO users (telegram_id, language)
+                VALUES (?, ?)
+                ON CONFLICT(telegram_id) DO UPDATE SET
+                    language = excluded.language
+            """, (telegram_id, language))
         await db.commit()
+    _invalidate_user(telegram_id)
 
 async def update_user_session(telegram_id: int, session_string: str, phone: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-            UPDATE users 
-            SET session_string = ?, phone = ?, status = 'active'
-            WHERE telegram_id = ?
-        """, (session_string, phone, telegram_id))
-        await db.commit()
+    await write("""
+        UPDATE users
+        SET session_string = ?, phone = ?, status = 'active'
+        WHERE telegram_id = ?
+    """, (session_string, phone, telegram_id))
+    _invalidate_user(telegram_id)
 
 async def sync_user_from_web_account(telegram_id: int):
     """Sync user data from web_accounts to users table for contact info"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         # Get data from web_accounts
         async with db.execute("""
             SELECT phone, name FROM web_accounts WHERE telegram_id = ?
@@ -398,63 +673,162 @@ async def sync_user_from_web_account(telegram_id: int):
                 WHERE telegram_id = ?
             """, (phone, name, telegram_id))
             await db.commit()
+            _invalidate_user(telegram_id)
+
+# SQL самых горячих запросов — модульные константы: строка создаётся
+# один раз, а не пересобирается на каждый вызов.
+# Явный список колонок: миграции добавляют колонки в конец, поэтому
+# SELECT * отдаёт разный порядок на старых и новых базах. Обработчики
+# читают строку по именам (row_factory=Row), но порядок зафиксирован
+# на случай оставшегося позиционного доступа
+_SQL_GET_USER = """
+    SELECT id, telegram_id, language, session_string, status,
+           phone, role, rating, deals_count, username
+    FROM users WHERE telegram_id = ?
+"""
 
 async def get_user(telegram_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)) as cursor:
-            return await cursor.fetchone()
+    cached = _user_cache.get(telegram_id)
+    if cached and cached[0] > monotonic():
+        return cached[1]
+    async with get_db() as db:
+        async with db.execute(_SQL_GET_USER, (telegram_id,)) as cursor:
+            row = await cursor.fetchone()
+    _user_cache[telegram_id] = (monotonic() + _CACHE_TTL, row)
+    return row
 
 async def add_monitored_chat(user_id: int, chat_id: int, chat_title: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
+    await write("""
+        INSERT OR IGNORE INTO monitored_chats (user_id, chat_id, chat_title)
+        VALUES (?, ?, ?)
+    """, (user_id, chat_id, chat_title))
+
+async def add_monitored_chats(rows):
+    """Массовое добавление чатов: rows = [(user_id, chat_id, chat_title), ...].
+
+    executemany готовит SQL один раз на всю пачку и делает один commit.
+    """
+    if not rows:
+        return
+    async with get_db() as db:
+        await db.executemany("""
             INSERT OR IGNORE INTO monitored_chats (user_id, chat_id, chat_title)
             VALUES (?, ?, ?)
-        """, (user_id, chat_id, chat_title))
+        """, rows)
         await db.commit()
 
 async def get_monitored_chats(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         async with db.execute("SELECT chat_id FROM monitored_chats WHERE user_id = ?", (user_id,)) as cursor:
             rows = await cursor.fetchall()
             return [row[0] for row in rows]
 
 async def get_monitored_chats_full(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with get_db() as db:
         async with db.execute("SELECT chat_id, chat_title FROM monitored_chats WHERE user_id = ?", (user_id,)) as cursor:
-            rows = await cursor.fetchall()
-            return [{"chat_id": row["chat_id"], "chat_title": row["chat_title"]} for row in rows]
+            # Rows support ["chat_id"] access directly - no need to
+            # allocate a dict per row
+            return await cursor.fetchall()
 
 async def clear_monitored_chats(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM monitored_chats WHERE user_id = ?", (user_id,))
-        await db.commit()
+    await write("DELETE FROM monitored_chats WHERE user_id = ?", (user_id,))
 
 async def remove_monitored_chat(user_id: int, chat_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM monitored_chats WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
-        await db.commit()
+    await write("DELETE FROM monitored_chats WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
+_RATES_AGG_UPSERT = """
+    INSERT INTO rates_agg (currency_pair, sum_buy, n)
+    VALUES (?, ?, 1)
+    ON CONFLICT(currency_pair) DO UPDATE SET
+        sum_buy = sum_buy + excluded.sum_buy,
+        n = n + 1
+"""
+
 async def add_market_rate(currency_pair: str, rate: float, source_group: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
+    await write("""
+        INSERT INTO market_rates (currency_pair, rate_buy, source_group)
+        VALUES (?, ?, ?)
+    """, (currency_pair, rate, source_group))
+    await write(_RATES_AGG_UPSERT, (currency_pair, rate))
+
+async def add_market_rates(rows):
+    """Массовая запись курсов: rows = [(currency_pair, rate_buy, source_group), ...]."""
+    if not rows:
+        return
+    async with get_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        await db.executemany("""
             INSERT INTO market_rates (currency_pair, rate_buy, source_group)
             VALUES (?, ?, ?)
-        """, (currency_pair, rate, source_group))
+        """, rows)
+        await db.executemany(_RATES_AGG_UPSERT, [(pair, rate) for pair, rate, _ in rows])
         await db.commit()
 
-async def get_average_rates():
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Получаем средний курс за последние 24 часа
-        async with db.execute("""
-            SELECT currency_pair, AVG(rate_buy) 
-            FROM market_rates 
+async def refresh_rates_agg():
+    """Пересобрать агрегат по последним 24 часам (выкидывает устаревшие строки).
+
+    Один скан в минуту из фоновой задачи вместо скана на каждое чтение.
+    """
+    async with get_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        await db.execute("DELETE FROM rates_agg")
+        await db.execute("""
+            INSERT INTO rates_agg (currency_pair, sum_buy, n)
+            SELECT currency_pair, SUM(rate_buy), COUNT(*)
+            FROM market_rates
             WHERE timestamp >= datetime('now', '-1 day')
             GROUP BY currency_pair
+        """)
+        await db.commit()
+
+async def rates_agg_refresh_loop(interval: int = 60):
+    """Фоновая задача: раз в минуту освежает rates_agg"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_rates_agg()
+        except Exception as e:
+            logging.error(f"Failed to refresh rates_agg: {e}")
+
+async def purge_expired_codes():
+    """Удалить протухшие/погашенные коды верификации.
+
+    Таблицы кодов растут бесконечно: каждая незавершённая регистрация
+    оставляет строку verified=0 навсегда. Частичным индексам это не
+    мешает, но страницы таблиц и размер бэкапа растут линейно.
+    """
+    async with get_db() as db:
+        await db.execute(
+            "DELETE FROM web_verification_codes WHERE created_at < datetime('now', '-1 day')"
+        )
+        await db.execute(
+            "DELETE FROM bot_verification_codes WHERE used = 1 OR created_at < datetime('now', '-1 hour')"
+        )
+        await db.execute(
+            "DELETE FROM seller_codes WHERE used = 1 AND created_at < datetime('now', '-7 days')"
+        )
+        await db.commit()
+
+async def code_purge_loop(interval: int = 3600):
+    """Фоновая задача: раз в час чистит таблицы кодов"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await purge_expired_codes()
+        except Exception as e:
+            logging.error(f"Failed to purge expired codes: {e}")
+
+async def get_average_rates():
+    # Средний курс за последние 24 часа из материализованного агрегата
+    async with get_db() as db:
+        async with db.execute("""
+            SELECT currency_pair, sum_buy / n
+            FROM rates_agg
+            WHERE n > 0
         """) as cursor:
             return await cursor.fetchall()
 
 async def add_template(user_id: int, content: str, media_type: str, caption: str = None, entities: str = None, name: str = None):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         cursor = await db.execute("""
             INSERT INTO templates (user_id, content, media_type, caption, entities, name)
             VALUES (?, ?, ?, ?, ?, ?)
@@ -463,7 +837,7 @@ async def add_template(user_id: int, content: str, media_type: str, caption: str
         return cursor.lastrowid
 
 async def get_user_templates(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         async with db.execute("SELECT id, content, media_type, caption, entities, name FROM templates WHERE user_id = ?", (user_id,)) as cursor:
             return await cursor.fetchall()
 
@@ -471,38 +845,81 @@ async def get_user_templates(user_id: int):
 
 
 async def get_template(template_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM templates WHERE id = ?", (template_id,)) as cursor:
+    async with get_db() as db:
+        async with db.execute("""
+            SELECT id, user_id, content, media_type, caption, entities, name
+            FROM templates WHERE id = ?
+        """, (template_id,)) as cursor:
             return await cursor.fetchone()
 
 async def deactivate_task(task_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE scheduled_tasks SET is_active = 0 WHERE id = ?", (task_id,))
-        await db.commit()
+    await write("UPDATE scheduled_tasks SET is_active = 0 WHERE id = ?", (task_id,))
 
 async def delete_template(user_id: int, template_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
+        # Явная транзакция: шаблон и его задачи удаляются атомарно,
+        # один fsync вместо двух
+        await db.execute("BEGIN IMMEDIATE")
         await db.execute("DELETE FROM templates WHERE id = ? AND user_id = ?", (template_id, user_id))
+        await db.execute("""
+            DELETE FROM scheduled_task_groups WHERE task_id IN (
+                SELECT id FROM scheduled_tasks WHERE template_id = ? AND user_id = ?
+            )
+        """, (template_id, user_id))
         await db.execute("DELETE FROM scheduled_tasks WHERE template_id = ? AND user_id = ?", (template_id, user_id))
         await db.commit()
 
 async def add_scheduled_task(user_id: int, template_id: int, target_groups: str, start_time: str, end_time: str, interval_minutes: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        # run_time больше не пишем: колонка дублировала start/end_time
+        # и нигде не читалась
         cursor = await db.execute(
             """
-            INSERT INTO scheduled_tasks (user_id, template_id, target_groups, start_time, end_time, interval_minutes, run_time)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO scheduled_tasks (user_id, template_id, target_groups, start_time, end_time, interval_minutes)
+            VALUES (?, ?, ?, ?, ?, ?)
             """,
-            (user_id, template_id, target_groups, start_time, end_time, interval_minutes, f"{start_time}-{end_time}"),
+            (user_id, template_id, target_groups, start_time, end_time, interval_minutes),
         )
+        task_id = cursor.lastrowid
+        # JSON парсится один раз при записи; дальше чаты читаются
+        # из нормализованной таблицы без парсинга
+        try:
+            groups = json.loads(target_groups) if target_groups else []
+        except (ValueError, TypeError):
+            groups = []
+        if groups:
+            await db.executemany(
+                "INSERT INTO scheduled_task_groups (task_id, chat_id) VALUES (?, ?)",
+                [(task_id, str(g)) for g in groups],
+            )
         await db.commit()
-        return cursor.lastrowid
+        return task_id
 
 
-async def get_scheduled_tasks():
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+async def get_scheduled_task_groups():
+    """Все целевые чаты активных задач одним сканом: {task_id: [chat_id, ...]}"""
+    groups: dict = {}
+    async with get_db() as db:
+        async with db.execute("""
+            SELECT g.task_id, g.chat_id
+            FROM scheduled_task_groups g
+            JOIN scheduled_tasks t ON t.id = g.task_id
+            WHERE t.is_active = 1
+        """) as cursor:
+            while chunk := await cursor.fetchmany(500):
+                for task_id, chat_id in chunk:
+                    groups.setdefault(task_id, []).append(chat_id)
+    return groups
+
+
+async def iter_scheduled_tasks():
+    """Итерация по активным задачам чанками по 500 строк.
+
+    fetchmany даёт один переход в executor-поток на чанк вместо одного
+    на строку и не буферизует всю таблицу в памяти разом.
+    """
+    async with get_db() as db:
         async with db.execute(
             """
             SELECT id, user_id, template_id, target_groups, start_time, end_time, interval_minutes
@@ -510,11 +927,17 @@ async def get_scheduled_tasks():
             WHERE is_active = 1
             """
         ) as cursor:
-            return await cursor.fetchall()
+            while chunk := await cursor.fetchmany(500):
+                for row in chunk:
+                    yield row
+
+
+async def get_scheduled_tasks():
+    return [row async for row in iter_scheduled_tasks()]
 
 
 async def get_user_active_tasks(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute(
             """
@@ -528,72 +951,100 @@ async def get_user_active_tasks(user_id: int):
 
 
 async def update_last_run(task_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE scheduled_tasks SET last_run = CURRENT_TIMESTAMP WHERE id = ?", (task_id,))
-        await db.commit()
+    await write("UPDATE scheduled_tasks SET last_run = CURRENT_TIMESTAMP WHERE id = ?", (task_id,))
+
 
+async def _create_table_without_rowid(db, table: str, create_sql: str):
+    """Создать таблицу WITHOUT ROWID, мигрировав старую rowid-версию.
 
-async def _ensure_column(db, table: str, column: str, definition: str):
-    """Добавить колонку, если её ещё нет (простой миграционный хелпер)."""
+    Если таблица уже существует как обычная rowid-таблица, она
+    переименовывается, создаётся заново и данные переливаются.
+    Не коммитит сам — полагается на транзакцию create_tables().
+    """
+    async with db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ) as cursor:
+        row = await cursor.fetchone()
+    if row and "WITHOUT ROWID" not in (row[0] or ""):
+        await db.execute(f"ALTER TABLE {table} RENAME TO {table}_rowid_old")
+        await db.execute(create_sql)
+        await db.execute(f"INSERT INTO {table} SELECT * FROM {table}_rowid_old")
+        await db.execute(f"DROP TABLE {table}_rowid_old")
+    else:
+        await db.execute(create_sql)
+
+
+async def _ensure_columns(db, table: str, specs: dict):
+    """Добавить недостающие колонки таблицы (простой миграционный хелпер).
+
+    Один PRAGMA table_info на таблицу вместо одного на колонку.
+    Не коммитит сам — полагается на транзакцию create_tables().
+    """
     async with db.execute(f"PRAGMA table_info({table})") as cursor:
-        cols = [row[1] for row in await cursor.fetchall()]
-    if column not in cols:
-        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
-        await db.commit()
+        existing = {row[1] for row in await cursor.fetchall()}
+    for column, definition in specs.items():
+        if column not in existing:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+_SQL_GET_SPAM_SETTINGS = """
+    SELECT chat_id, block_links, block_keywords,
+           flood_max_msgs, flood_window, flood_mute_time, action
+    FROM spam_settings WHERE chat_id = ?
+"""
 
 async def get_spam_settings(chat_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM spam_settings WHERE chat_id = ?", (chat_id,)) as cursor:
-            return await cursor.fetchone()
+    cached = _spam_cache.get(chat_id)
+    if cached and cached[0] > monotonic():
+        return cached[1]
+    async with get_db() as db:
+        async with db.execute(_SQL_GET_SPAM_SETTINGS, (chat_id,)) as cursor:
+            row = await cursor.fetchone()
+    _spam_cache[chat_id] = (monotonic() + _CACHE_TTL, row)
+    return row
 
 async def update_spam_settings(chat_id: int, block_links: bool, block_keywords: str, flood_max_msgs: int = 0, flood_window: int = 60, flood_mute_time: int = 300):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-            INSERT INTO spam_settings (chat_id, block_links, block_keywords, flood_max_msgs, flood_window, flood_mute_time)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ON CONFLICT(chat_id) DO UPDATE SET
-                block_links = excluded.block_links,
-                block_keywords = excluded.block_keywords,
-                flood_max_msgs = excluded.flood_max_msgs,
-                flood_window = excluded.flood_window,
-                flood_mute_time = excluded.flood_mute_time
-        """, (chat_id, block_links, block_keywords, flood_max_msgs, flood_window, flood_mute_time))
-        await db.commit()
+    await write("""
+        INSERT INTO spam_settings (chat_id, block_links, block_keywords, flood_max_msgs, flood_window, flood_mute_time)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET
+            block_links = excluded.block_links,
+            block_keywords = excluded.block_keywords,
+            flood_max_msgs = excluded.flood_max_msgs,
+            flood_window = excluded.flood_window,
+            flood_mute_time = excluded.flood_mute_time
+    """, (chat_id, block_links, block_keywords, flood_max_msgs, flood_window, flood_mute_time))
+    _spam_cache.pop(chat_id, None)
 
 async def add_banned_user_challenge(user_id: int, chat_id: int, correct_answer: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-            INSERT OR REPLACE INTO banned_users (user_id, chat_id, attempts_left, correct_answer)
-            VALUES (?, ?, 2, ?)
-        """, (user_id, chat_id, correct_answer))
-        await db.commit()
+    await write("""
+        INSERT INTO banned_users (user_id, chat_id, attempts_left, correct_answer)
+        VALUES (?, ?, 2, ?)
+        ON CONFLICT(user_id, chat_id) DO UPDATE SET
+            attempts_left = 2,
+            correct_answer = excluded.correct_answer,
+            timestamp = CURRENT_TIMESTAMP
+    """, (user_id, chat_id, correct_answer))
 
 async def get_banned_user_challenge(user_id: int, chat_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("SELECT * FROM banned_users WHERE user_id = ? AND chat_id = ?", (user_id, chat_id)) as cursor:
             return await cursor.fetchone()
 
 async def update_banned_attempts(user_id: int, chat_id: int, attempts: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE banned_users SET attempts_left = ? WHERE user_id = ? AND chat_id = ?", (attempts, user_id, chat_id))
-        await db.commit()
+    await write("UPDATE banned_users SET attempts_left = ? WHERE user_id = ? AND chat_id = ?", (attempts, user_id, chat_id))
 
 async def remove_banned_user_challenge(user_id: int, chat_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM banned_users WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
-        await db.commit()
+    await write("DELETE FROM banned_users WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
 
 # --- P2P Exchange Functions ---
 
 async def update_user_role(telegram_id: int, role: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET role = ? WHERE telegram_id = ?", (role, telegram_id))
-        await db.commit()
+    await write("UPDATE users SET role = ? WHERE telegram_id = ?", (role, telegram_id))
+    _invalidate_user(telegram_id)
 
 async def create_order(user_id: int, amount: float, currency: str, location: str, delivery_type: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         cursor = await db.execute("""
             INSERT INTO orders (user_id, amount, currency, location, delivery_type)
             VALUES (?, ?, ?, ?, ?)
@@ -601,25 +1052,28 @@ async def create_order(user_id: int, amount: float, currency: str, location: str
         await db.commit()
         return cursor.lastrowid
 
+_ORDER_COLUMNS = "id, user_id, amount, currency, location, delivery_type, status, created_at"
+
 async def get_active_orders():
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM orders WHERE status = 'active' ORDER BY created_at DESC") as cursor:
+    async with get_db() as db:
+        async with db.execute(f"SELECT {_ORDER_COLUMNS} FROM orders WHERE status = 'active' ORDER BY created_at DESC") as cursor:
             return [dict(row) for row in await cursor.fetchall()]
 
 async def get_user_orders(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC", (user_id,)) as cursor:
+    async with get_db() as db:
+        async with db.execute(f"SELECT {_ORDER_COLUMNS} FROM orders WHERE user_id = ? ORDER BY created_at DESC", (user_id,)) as cursor:
             return [dict(row) for row in await cursor.fetchall()]
 
 async def get_order(order_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with get_db() as db:
+        # Скалярные подзапросы вместо LEFT JOIN: для точечной выборки
+        # одной строки это те же B-tree-пробы без материализации джойна
         async with db.execute("""
-            SELECT o.*, u.phone, u.username 
+            SELECT o.id, o.user_id, o.amount, o.currency, o.location,
+                   o.delivery_type, o.status, o.created_at,
+                   (SELECT phone FROM users WHERE telegram_id = o.user_id) AS phone,
+                   (SELECT username FROM users WHERE telegram_id = o.user_id) AS username
             FROM orders o
-            LEFT JOIN users u ON o.user_id = u.telegram_id
             WHERE o.id = ?
         """, (order_id,)) as cursor:
             row = await cursor.fetchone()
@@ -627,12 +1081,10 @@ async def get_order(order_id: int):
 
 async def cancel_order(order_id: int):
     """Cancel an order"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE orders SET status = 'cancelled' WHERE id = ?", (order_id,))
-        await db.commit()
+    await write("UPDATE orders SET status = 'cancelled' WHERE id = ?", (order_id,))
 
 async def place_bid(order_id: int, exchanger_id: int, rate: float, time_estimate: str, comment: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         cursor = await db.execute("""
             INSERT INTO bids (order_id, exchanger_id, rate, time_estimate, comment)
             VALUES (?, ?, ?, ?, ?)
@@ -641,30 +1093,44 @@ async def place_bid(order_id: int, exchanger_id: int, rate: float, time_estimate
         return cursor.lastrowid
 
 async def accept_bid(bid_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Get bid details first
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM bids WHERE id = ?", (bid_id,)) as cursor:
-            bid = await cursor.fetchone()
-            if not bid:
+    async with get_db() as db:
+        # BEGIN IMMEDIATE берёт write-лок сразу, чтобы другой писатель
+        # не вклинился между чтением ставки и обновлением заказа
+        await db.execute("BEGIN IMMEDIATE")
+
+        if _HAS_RETURNING:
+            # UPDATE ... RETURNING принимает ставку и возвращает её
+            # строку за один проход — без отдельного SELECT
+            async with db.execute(
+                "UPDATE bids SET status = 'accepted' WHERE id = ? RETURNING *",
+                (bid_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                await db.commit()
                 return None
-            bid = dict(bid)
+            bid = dict(row)
+        else:
+            async with db.execute("SELECT * FROM bids WHERE id = ?", (bid_id,)) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                await db.commit()
+                return None
+            bid = dict(row)
+            await db.execute("UPDATE bids SET status = 'accepted' WHERE id = ?", (bid_id,))
 
         # Update order status to closed
         await db.execute("UPDATE orders SET status = 'closed' WHERE id = ?", (bid['order_id'],))
-        
-        # Update bid status to accepted
-        await db.execute("UPDATE bids SET status = 'accepted' WHERE id = ?", (bid_id,))
-        
+
         # Reject other bids for this order (optional, but good for clarity)
         await db.execute("UPDATE bids SET status = 'rejected' WHERE order_id = ? AND id != ?", (bid['order_id'], bid_id))
-        
+
         await db.commit()
         return bid
 
 async def complete_bid(bid_id: int):
     """Mark a bid as completed - deal finished"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         
         # Get bid first
@@ -684,13 +1150,14 @@ async def complete_bid(bid_id: int):
         await db.execute("""
             UPDATE users SET deals_count = COALESCE(deals_count, 0) + 1 WHERE telegram_id = ?
         """, (bid['exchanger_id'],))
-        
+
         await db.commit()
-        return bid
+    _invalidate_user(bid['exchanger_id'])
+    return bid
 
 
 async def get_order_bids(order_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         # Join with users and web_accounts to get exchanger info
         async with db.execute("""
@@ -708,39 +1175,35 @@ async def get_order_bids(order_id: int):
 
 async def update_bid_message_id(bid_id: int, message_id: int):
     """Store the Telegram message ID for a bid notification"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE bids SET message_id = ? WHERE id = ?", (message_id, bid_id))
-        await db.commit()
+    await write("UPDATE bids SET message_id = ? WHERE id = ?", (message_id, bid_id))
 
 async def clear_completed_bids(user_id: int):
     """Delete completed/rejected bids for a user (clear archive)"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            "DELETE FROM bids WHERE exchanger_id = ? AND status IN ('accepted', 'rejected', 'completed')",
-            (user_id,)
-        )
-        await db.commit()
+    await write(
+        "DELETE FROM bids WHERE exchanger_id = ? AND status IN ('accepted', 'rejected', 'completed')",
+        (user_id,)
+    )
 
 async def get_rejected_bids_with_messages(order_id: int, accepted_bid_id: int):
     """Get all rejected bids with their message_ids for cleanup"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with get_db() as db:
         async with db.execute("""
-            SELECT id, exchanger_id, message_id, order_id 
-            FROM bids 
+            SELECT id, exchanger_id, message_id, order_id
+            FROM bids
             WHERE order_id = ? AND id != ? AND message_id IS NOT NULL
         """, (order_id, accepted_bid_id)) as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+            # Callers index rows by column name, which Row supports
+            return await cursor.fetchall()
 
 async def get_order_client_id(order_id: int):
     """Get the client's telegram ID for an order"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         async with db.execute("SELECT user_id FROM orders WHERE id = ?", (order_id,)) as cursor:
             row = await cursor.fetchone()
             return row[0] if row else None
 
 async def get_user_bids(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         # Join with orders, users and web_accounts to get client info
         async with db.execute("""
@@ -759,7 +1222,7 @@ async def get_user_bids(user_id: int):
             return [dict(row) for row in await cursor.fetchall()]
 
 async def create_market_post(user_id: int, p_type: str, amount: float, currency: str, rate: float, location: str, description: str, category: str = None, image_data: str = None, title: str = None):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         await db.execute("""
             INSERT INTO market_posts (user_id, type, amount, currency, rate, location, description, category, image_data, title)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
@@ -768,11 +1231,14 @@ async def create_market_post(user_id: int, p_type: str, amount: float, currency:
 
 async def get_market_posts():
     """Get all market posts with author info"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with get_db() as db:
+        # Явный список колонок вместо mp.*: image_data остаётся,
+        # пока лента на фронтенде рендерит картинки из него
         async with db.execute("""
-            SELECT mp.*, 
-                   u.username as author_username, 
+            SELECT mp.id, mp.user_id, mp.type, mp.amount, mp.currency,
+                   mp.rate, mp.location, mp.description, mp.category,
+                   mp.title, mp.image_data, mp.created_at,
+                   u.username as author_username,
                    u.display_name as author_name,
                    wa.avatar_url as author_avatar_url,
                    COALESCE(wa.name, u.display_name, u.username) as author_display_name
@@ -782,17 +1248,19 @@ async def get_market_posts():
             ORDER BY mp.created_at DESC LIMIT 50
         """) as cursor:
             posts = []
-            for row in await cursor.fetchall():
-                post = dict(row)
-                # Use the better name
-                if post.get('author_display_name'):
-                    post['author_name'] = post['author_display_name']
-                posts.append(post)
+            # fetchmany keeps the per-row executor-thread hops bounded
+            while chunk := await cursor.fetchmany(500):
+                for row in chunk:
+                    post = dict(row)
+                    # Use the better name
+                    if post.get('author_display_name'):
+                        post['author_name'] = post['author_display_name']
+                    posts.append(post)
             return posts
 
 async def get_exchangers_by_location(location: str = None):
     """Get all exchangers - checks both users and web_accounts tables"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         # Get from web_accounts (Bot-First registration) - include language from users table
         async with db.execute("""
@@ -819,15 +1287,18 @@ async def get_exchangers_by_location(location: str = None):
         return result
 
 async def save_verification_code(phone: str, code: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         await db.execute("""
-            INSERT OR REPLACE INTO verification_codes (phone, code, created_at)
+            INSERT INTO verification_codes (phone, code, created_at)
             VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(phone) DO UPDATE SET
+                code = excluded.code,
+                created_at = CURRENT_TIMESTAMP
         """, (phone, code))
         await db.commit()
 
 async def verify_code(phone: str, code: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         async with db.execute("SELECT code FROM verification_codes WHERE phone = ?", (phone,)) as cursor:
             row = await cursor.fetchone()
             if row and row[0] == code:
@@ -838,89 +1309,131 @@ async def verify_code(phone: str, code: str):
 
 async def save_verification_code_by_user(user_id: int, code: str, phone: str):
     """Save verification code linked to user_id"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Use code itself as the key for easy lookup
+    async with get_db() as db:
         await db.execute("""
-            INSERT OR REPLACE INTO verification_codes (phone, code, created_at)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-        """, (f"code_{code}", str(user_id)))  # Store user_id in code column for retrieval
+            INSERT INTO code_challenges (code, user_id, state, created_at)
+            VALUES (?, ?, 'pending', CURRENT_TIMESTAMP)
+            ON CONFLICT(code) DO UPDATE SET
+                user_id = excluded.user_id,
+                state = 'pending',
+                created_at = CURRENT_TIMESTAMP
+        """, (code, user_id))
         # Also save the phone for later
         await db.execute("UPDATE users SET phone = ? WHERE telegram_id = ?", (phone, user_id))
         await db.commit()
+    _invalidate_user(user_id)
+
+
+async def register_and_issue_code(user_id: int, language: str, code: str, phone: str):
+    """Завести пользователя и выдать код одним заходом в базу.
+
+    Легаси-эндпоинт generate-code раньше делал это через add_user +
+    save_verification_code_by_user — два захвата соединения и два
+    commit на один запрос.
+    """
+    async with get_db() as db:
+        await db.execute("""
+            INSERT INTO users (telegram_id, language)
+            VALUES (?, ?)
+            ON CONFLICT(telegram_id) DO NOTHING
+        """, (user_id, language))
+        await db.execute("""
+            INSERT INTO code_challenges (code, user_id, state, created_at)
+            VALUES (?, ?, 'pending', CURRENT_TIMESTAMP)
+            ON CONFLICT(code) DO UPDATE SET
+                user_id = excluded.user_id,
+                state = 'pending',
+                created_at = CURRENT_TIMESTAMP
+        """, (code, user_id))
+        await db.execute("UPDATE users SET phone = ? WHERE telegram_id = ?", (phone, user_id))
+        await db.commit()
+    _invalidate_user(user_id)
 
 async def verify_code_by_user(user_id: int, code: str) -> bool:
     """Verify code submitted by user through bot - code is the key"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Look up by code itself
-        async with db.execute("SELECT code FROM verification_codes WHERE phone = ?", (f"code_{code}",)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                # Mark code as verified (change phone prefix from code_ to verified_)
-                await db.execute("UPDATE verification_codes SET phone = ? WHERE phone = ?", 
-                               (f"verified_{code}", f"code_{code}"))
-                # Also mark THIS user as verified
-                await db.execute("UPDATE users SET status = 'verified' WHERE telegram_id = ?", (user_id,))
-                await db.commit()
-                return True
-            return False
+    async with get_db() as db:
+        # Один UPDATE вместо SELECT + UPDATE: rowcount говорит,
+        # был ли код в ожидании
+        cursor = await db.execute(
+            "UPDATE code_challenges SET state = 'verified' WHERE code = ? AND state = 'pending'",
+            (code,)
+        )
+        if cursor.rowcount:
+            # Also mark THIS user as verified
+            await db.execute("UPDATE users SET status = 'verified' WHERE telegram_id = ?", (user_id,))
+            await db.commit()
+            _invalidate_user(user_id)
+            return True
+        await db.commit()
+        return False
 
 async def is_code_verified(code: str) -> bool:
     """Check if code has been verified via bot"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT 1 FROM verification_codes WHERE phone = ?", (f"verified_{code}",)) as cursor:
+    async with get_db() as db:
+        async with db.execute(
+            "SELECT 1 FROM code_challenges WHERE code = ? AND state = 'verified'",
+            (code,)
+        ) as cursor:
             row = await cursor.fetchone()
             return row is not None
 
 async def is_user_verified(user_id: int) -> bool:
     """Check if user completed verification"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         async with db.execute("SELECT status FROM users WHERE telegram_id = ?", (user_id,)) as cursor:
             row = await cursor.fetchone()
             return row and row[0] == 'verified'
 
 async def update_user_profile(telegram_id: int, phone: str, username: str, name: str = None):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-            UPDATE users 
-            SET phone = ?, username = ?, display_name = COALESCE(?, display_name) 
-            WHERE telegram_id = ?
-        """, (phone, username, name, telegram_id))
-        await db.commit()
+    await write("""
+        UPDATE users
+        SET phone = ?, username = ?, display_name = COALESCE(?, display_name)
+        WHERE telegram_id = ?
+    """, (phone, username, name, telegram_id))
+    _invalidate_user(telegram_id)
 
 async def create_category(name: str, created_by: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    global _categories_cache
+    async with get_db() as db:
         try:
             await db.execute("INSERT INTO categories (name, created_by) VALUES (?, ?)", (name, created_by))
             await db.commit()
+            _categories_cache = None
             return True
         except aiosqlite.IntegrityError:
             return False
 
 async def get_categories():
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    global _categories_cache
+    if _categories_cache and _categories_cache[0] > monotonic():
+        return _categories_cache[1]
+    async with get_db() as db:
         async with db.execute("SELECT name FROM categories ORDER BY created_at DESC") as cursor:
-            return [row['name'] for row in await cursor.fetchall()]
+            names = [row['name'] for row in await cursor.fetchall()]
+    _categories_cache = (monotonic() + _CACHE_TTL, names)
+    return names
 
 async def get_user_stats(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT COUNT(*) FROM orders WHERE user_id = ? AND status = 'active'", (user_id,)) as cursor:
-            active = (await cursor.fetchone())[0]
-        
-        async with db.execute("SELECT COUNT(*) FROM orders WHERE user_id = ? AND status = 'closed'", (user_id,)) as cursor:
-            completed = (await cursor.fetchone())[0]
-            
-        return {'active': active, 'completed': completed}
+    async with get_db() as db:
+        # Один условный агрегат вместо двух COUNT-запросов —
+        # один проход по idx_orders_user_status
+        async with db.execute("""
+            SELECT COALESCE(SUM(status = 'active'), 0),
+                   COALESCE(SUM(status = 'closed'), 0)
+            FROM orders WHERE user_id = ?
+        """, (user_id,)) as cursor:
+            row = await cursor.fetchone()
+        return {'active': row[0], 'completed': row[1]}
 
 async def get_user_market_posts(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("SELECT * FROM market_posts WHERE user_id = ? ORDER BY created_at DESC", (user_id,)) as cursor:
             return [dict(row) for row in await cursor.fetchall()]
 
 async def get_market_post(post_id: int):
     """Get single market post by ID with author info"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("""
             SELECT mp.*, 
@@ -942,8 +1455,10 @@ async def get_market_post(post_id: int):
                 return result
             return None
 
+_market_post_update_sql: dict = {}
+
 async def update_market_post(post_id: int, user_id: int, amount: float, rate: float, description: str, p_type: str = None, currency: str = None, location: str = None, category: str = None, image_data: str = None, title: str = None):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         # Construct query dynamically based on provided fields
         fields = []
         values = []
@@ -980,13 +1495,19 @@ async def update_market_post(post_id: int, user_id: int, amount: float, rate: fl
 
         values.append(post_id)
         values.append(user_id)
-        
-        query = f"UPDATE market_posts SET {', '.join(fields)} WHERE id = ? AND user_id = ?"
+
+        # Вариантов запроса не больше 2^9 — кэшируем собранный текст,
+        # чтобы одинаковые наборы полей попадали в statement-кэш sqlite3
+        key = tuple(fields)
+        query = _market_post_update_sql.get(key)
+        if query is None:
+            query = f"UPDATE market_posts SET {', '.join(fields)} WHERE id = ? AND user_id = ?"
+            _market_post_update_sql[key] = query
         await db.execute(query, tuple(values))
         await db.commit()
 
 async def delete_market_post(post_id: int, user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         await db.execute("DELETE FROM market_posts WHERE id = ? AND user_id = ?", (post_id, user_id))
         await db.commit()
 
@@ -994,7 +1515,7 @@ async def delete_market_post(post_id: int, user_id: int):
 
 async def add_favorite(user_id: int, post_id: int):
     """Add a post to user's favorites"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         try:
             await db.execute(
                 "INSERT OR IGNORE INTO favorites (user_id, post_id) VALUES (?, ?)",
@@ -1007,16 +1528,14 @@ async def add_favorite(user_id: int, post_id: int):
 
 async def remove_favorite(user_id: int, post_id: int):
     """Remove a post from user's favorites"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            "DELETE FROM favorites WHERE user_id = ? AND post_id = ?",
-            (user_id, post_id)
-        )
-        await db.commit()
+    await write(
+        "DELETE FROM favorites WHERE user_id = ? AND post_id = ?",
+        (user_id, post_id)
+    )
 
 async def get_user_favorites(user_id: int):
     """Get all favorite posts for a user with post details"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         async with db.execute("""
             SELECT mp.*, 
@@ -1041,7 +1560,7 @@ async def get_user_favorites(user_id: int):
 
 async def is_favorite(user_id: int, post_id: int) -> bool:
     """Check if a post is in user's favorites"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         async with db.execute(
             "SELECT 1 FROM favorites WHERE user_id = ? AND post_id = ?",
             (user_id, post_id)
@@ -1050,7 +1569,7 @@ async def is_favorite(user_id: int, post_id: int) -> bool:
 
 async def get_user_favorite_ids(user_id: int):
     """Get list of favorite post IDs for a user"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         async with db.execute(
             "SELECT post_id FROM favorites WHERE user_id = ?",
             (user_id,)
@@ -1061,7 +1580,7 @@ async def get_user_favorite_ids(user_id: int):
 
 async def create_report(reporter_id: int, reported_user_id: int = None, post_id: int = None, reason: str = "", comment: str = None):
     """Create a report for a user or post"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         await db.execute("""
             INSERT INTO reports (reporter_id, reported_user_id, post_id, reason, comment)
             VALUES (?, ?, ?, ?, ?)
@@ -1072,7 +1591,7 @@ async def create_report(reporter_id: int, reported_user_id: int = None, post_id:
 
 async def hide_post(user_id: int, post_id: int):
     """Hide a post for a user (Not Interested)"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         try:
             await db.execute(
                 "INSERT OR IGNORE INTO hidden_posts (user_id, post_id) VALUES (?, ?)",
@@ -1085,7 +1604,7 @@ async def hide_post(user_id: int, post_id: int):
 
 async def get_hidden_post_ids(user_id: int):
     """Get list of hidden post IDs for a user"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         async with db.execute(
             "SELECT post_id FROM hidden_posts WHERE user_id = ?",
             (user_id,)
@@ -1094,25 +1613,44 @@ async def get_hidden_post_ids(user_id: int):
 
 # ============= WEB ACCOUNT AUTH FUNCTIONS =============
 
+import bcrypt
 import hashlib
 import secrets
 import string
 
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    # bcrypt, как и в app/services/auth_service.py: одиночный SHA-256
+    # перебирается на GPU миллиардами в секунду
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+
+def verify_password(password: str, stored_hash: str) -> bool:
+    """Проверка пароля; понимает и старые SHA-256-хэши"""
+    if not stored_hash:
+        return False
+    if stored_hash.startswith("$2"):
+        try:
+            return bcrypt.checkpw(password.encode(), stored_hash.encode())
+        except ValueError:
+            return False
+    # Легаси-запись до перехода на bcrypt
+    legacy = hashlib.sha256(password.encode()).hexdigest()
+    return secrets.compare_digest(legacy, stored_hash)
+
+# Один вызов os.urandom на код вместо secrets.choice() на каждый символ
 
 def generate_numeric_code(length: int = 6) -> str:
-    return ''.join(secrets.choice(string.digits) for _ in range(length))
+    return f"{secrets.randbelow(10 ** length):0{length}d}"
 
 def generate_alpha_code(length: int = 7) -> str:
-    return ''.join(secrets.choice(string.ascii_lowercase) for _ in range(length))
+    # Верхний регистр: verify_seller_code нормализует ввод через .upper()
+    return ''.join(string.ascii_uppercase[b % 26] for b in secrets.token_bytes(length))
 
 
 # ============= BOT-FIRST AUTH FUNCTIONS =============
 
 async def get_user_by_telegram_id(telegram_id: int) -> dict:
     """Get user account by telegram_id (for Bot-First flow)"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             "SELECT * FROM web_accounts WHERE telegram_id = ?",
@@ -1129,24 +1667,26 @@ async def register_user_via_bot(telegram_id: int, nickname: str, password: str,
     Bot-First Registration: User registers through Telegram bot.
     Creates account with telegram_id already linked.
     """
-    # Check if nickname is taken
-    if await check_nickname_exists(nickname):
-        return {"error": "nickname_exists"}
-    
     # Check if telegram_id already has an account
     existing = await get_user_by_telegram_id(telegram_id)
     if existing:
         return {"error": "already_registered"}
-    
-    password_hash = hash_password(password)
-    
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Create web account with telegram_id pre-linked
-        cursor = await db.execute(
-            """INSERT INTO web_accounts (nickname, name, password_hash, telegram_id, role) 
-               VALUES (?, ?, ?, ?, 'client')""",
-            (nickname, nickname, password_hash, telegram_id)
-        )
+
+    # bcrypt намеренно медленный — не блокируем им event loop
+    password_hash = await asyncio.to_thread(hash_password, password)
+
+    async with get_db() as db:
+        # Create web account with telegram_id pre-linked; занятость ника
+        # ловит уникальный индекс вместо отдельного SELECT
+        try:
+            cursor = await db.execute(
+                """INSERT INTO web_accounts (nickname, nickname_lower, name, password_hash, telegram_id, role)
+                   VALUES (?, ?, ?, ?, ?, 'client')""",
+                (nickname, nickname.lower(), nickname, password_hash, telegram_id)
+            )
+        except sqlite3.IntegrityError:
+            await db.rollback()
+            return {"error": "nickname_exists"}
         account_id = cursor.lastrowid
         
         # Also ensure user exists in users table (for bot functionality)
@@ -1157,7 +1697,8 @@ async def register_user_via_bot(telegram_id: int, nickname: str, password: str,
         )
         
         await db.commit()
-        
+
+        _nick_filter_add(nickname.lower())
         return {
             "success": True,
             "account_id": account_id,
@@ -1168,7 +1709,7 @@ async def register_user_via_bot(telegram_id: int, nickname: str, password: str,
 
 async def get_telegram_id_by_account(account_id: int) -> int:
     """Get telegram_id linked to a web account (for Become Seller 2FA)"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT telegram_id FROM web_accounts WHERE id = ?",
             (account_id,)
@@ -1177,24 +1718,59 @@ async def get_telegram_id_by_account(account_id: int) -> int:
         return row[0] if row else None
 
 
+_SQL_CHECK_NICK = "SELECT id FROM web_accounts WHERE nickname_lower = ?"
+
+# Множество занятых ников в памяти: почти все проверки при регистрации
+# отрицательные, и их можно отвечать без похода в базу. При промахе
+# (ник числится занятым) всё равно сверяемся с базой, так что фильтр
+# не может дать ложный отказ.
+_nick_filter: set | None = None
+_nick_filter_lock = asyncio.Lock()
+
+
+async def _get_nick_filter() -> set:
+    global _nick_filter
+    if _nick_filter is None:
+        async with _nick_filter_lock:
+            if _nick_filter is None:
+                async with get_db() as db:
+                    cursor = await db.execute(
+                        "SELECT nickname_lower FROM web_accounts WHERE nickname_lower IS NOT NULL"
+                    )
+                    rows = await cursor.fetchall()
+                _nick_filter = {row[0] for row in rows}
+    return _nick_filter
+
+
+def _nick_filter_add(nickname_lower: str):
+    if _nick_filter is not None:
+        _nick_filter.add(nickname_lower)
+
+
 async def check_nickname_exists(nickname: str) -> bool:
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT id FROM web_accounts WHERE LOWER(nickname) = LOWER(?)", (nickname,))
+    nickname_lower = nickname.lower()
+    if nickname_lower not in await _get_nick_filter():
+        return False  # точный отрицательный ответ, база не нужна
+    async with get_db() as db:
+        cursor = await db.execute(_SQL_CHECK_NICK, (nickname_lower,))
         row = await cursor.fetchone()
         return row is not None
 
 async def register_web_account(nickname: str, name: str, password: str) -> dict:
     """Register new web account, returns account info with verification code"""
-    if await check_nickname_exists(nickname):
-        return {"error": "nickname_exists"}
-    
-    password_hash = hash_password(password)
-    
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute(
-            "INSERT INTO web_accounts (nickname, name, password_hash) VALUES (?, ?, ?)",
-            (nickname, name, password_hash)
-        )
+    password_hash = await asyncio.to_thread(hash_password, password)
+
+    async with get_db() as db:
+        # Без предварительного SELECT: уникальность ника гарантирует
+        # индекс, а SELECT-потом-INSERT оставлял окно для гонки
+        try:
+            cursor = await db.execute(
+                "INSERT INTO web_accounts (nickname, nickname_lower, name, password_hash) VALUES (?, ?, ?, ?)",
+                (nickname, nickname.lower(), name, password_hash)
+            )
+        except sqlite3.IntegrityError:
+            await db.rollback()
+            return {"error": "nickname_exists"}
         account_id = cursor.lastrowid
         
         # Generate verification code
@@ -1204,7 +1780,8 @@ async def register_web_account(nickname: str, name: str, password: str) -> dict:
             (account_id, code)
         )
         await db.commit()
-        
+
+        _nick_filter_add(nickname.lower())
         return {
             "success": True,
             "account_id": account_id,
@@ -1215,35 +1792,55 @@ async def register_web_account(nickname: str, name: str, password: str) -> dict:
 
 async def login_web_account(nickname: str, password: str) -> dict:
     """Login with nickname and password"""
-    password_hash = hash_password(password)
-    
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with get_db() as db:
+        # Хэш солёный, поэтому ищем только по нику и сверяем в Python.
+        # Явный список колонок — SELECT * тянул бы и лишние blob-поля;
+        # кортеж распаковываем позиционно, без Row-обёртки
         cursor = await db.execute(
-            "SELECT * FROM web_accounts WHERE LOWER(nickname) = LOWER(?) AND password_hash = ?",
-            (nickname, password_hash)
+            """SELECT id, nickname, name, password_hash, role, telegram_id,
+                      is_seller_verified, avatar_url, original_avatar_url
+               FROM web_accounts WHERE nickname_lower = ?""",
+            (nickname.lower(),)
         )
         row = await cursor.fetchone()
-        
-        if not row:
-            return {"error": "invalid_credentials"}
-        
-        return {
-            "success": True,
-            "account_id": row["id"],
-            "nickname": row["nickname"],
-            "name": row["name"],
-            "role": row["role"],
-            "telegram_id": row["telegram_id"],
-            "telegram_linked": row["telegram_id"] is not None,
-            "is_seller": row["is_seller_verified"] == 1,
-            "avatar_url": row["avatar_url"],
-            "original_avatar_url": row["original_avatar_url"] if "original_avatar_url" in row.keys() else None
-        }
+
+    if not row:
+        return {"error": "invalid_credentials"}
+
+    (account_id, acc_nickname, name, password_hash, role, telegram_id,
+     is_seller_verified, avatar_url, original_avatar_url) = row
+
+    # Сверка и перехэширование идут в пуле потоков и вне db-лока:
+    # bcrypt занимает десятки миллисекунд на запрос
+    if not await asyncio.to_thread(verify_password, password, password_hash):
+        return {"error": "invalid_credentials"}
+
+    # Ленивая миграция: легаси SHA-256 перехэшируем при удачном входе
+    if not password_hash.startswith("$2"):
+        new_hash = await asyncio.to_thread(hash_password, password)
+        async with get_db() as db:
+            await db.execute(
+                "UPDATE web_accounts SET password_hash = ? WHERE id = ?",
+                (new_hash, account_id)
+            )
+            await db.commit()
+
+    return {
+        "success": True,
+        "account_id": account_id,
+        "nickname": acc_nickname,
+        "name": name,
+        "role": role,
+        "telegram_id": telegram_id,
+        "telegram_linked": telegram_id is not None,
+        "is_seller": is_seller_verified == 1,
+        "avatar_url": avatar_url,
+        "original_avatar_url": original_avatar_url
+    }
 
 async def update_avatar(account_id: int, avatar_url: str, original_avatar_url: str = None):
     """Update avatar URL and original image for account"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         # Add original_avatar_url column if it doesn't exist
         try:
             await db.execute("ALTER TABLE web_accounts ADD COLUMN original_avatar_url TEXT")
@@ -1258,7 +1855,7 @@ async def update_avatar(account_id: int, avatar_url: str, original_avatar_url: s
 
 async def get_web_account_by_telegram_id(telegram_id: int):
     """Get web account by telegram ID"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             "SELECT * FROM web_accounts WHERE telegram_id = ?",
@@ -1267,73 +1864,101 @@ async def get_web_account_by_telegram_id(telegram_id: int):
         row = await cursor.fetchone()
         return dict(row) if row else None
 
-async def get_user_reviews(user_id: int):
-    """Get reviews for a user - placeholder until reviews table exists"""
-    return []
+def _norm_phone(phone: str) -> str:
+    """Canonical phone form stored in web_accounts.phone_normalized"""
+    return phone.replace('+', '').replace(' ', '').replace('-', '') if phone else phone
+
 
 async def verify_code_from_bot(code: str, telegram_id: int, phone: str) -> dict:
     """Bot verifies the code and links Telegram account"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Find the code
-        cursor = await db.execute(
-            "SELECT id, account_id FROM web_verification_codes WHERE code = ? AND verified = 0",
-            (code,)
-        )
-        row = await cursor.fetchone()
-        
-        if not row:
-            return {"error": "invalid_code"}
-        
-        code_id, account_id = row
-        
-        # Update verification
-        await db.execute(
-            "UPDATE web_verification_codes SET verified = 1, telegram_id = ?, phone = ? WHERE id = ?",
-            (telegram_id, phone, code_id)
-        )
-        
+    async with get_db() as db:
+        if _HAS_RETURNING:
+            # Поиск и погашение кода одним UPDATE...RETURNING вместо
+            # SELECT + UPDATE — минус один прыжок в рабочий поток
+            cursor = await db.execute(
+                """UPDATE web_verification_codes
+                   SET verified = 1, telegram_id = ?, phone = ?
+                   WHERE code = ? AND verified = 0
+                   RETURNING account_id""",
+                (telegram_id, phone, code)
+            )
+            row = await cursor.fetchone()
+
+            if not row:
+                await db.rollback()
+                return {"error": "invalid_code"}
+
+            account_id = row[0]
+        else:
+            cursor = await db.execute(
+                "SELECT id, account_id FROM web_verification_codes WHERE code = ? AND verified = 0",
+                (code,)
+            )
+            row = await cursor.fetchone()
+
+            if not row:
+                return {"error": "invalid_code"}
+
+            code_id, account_id = row
+
+            await db.execute(
+                "UPDATE web_verification_codes SET verified = 1, telegram_id = ?, phone = ? WHERE id = ?",
+                (telegram_id, phone, code_id)
+            )
+
         # Link telegram to account
         await db.execute(
-            "UPDATE web_accounts SET telegram_id = ?, phone = ? WHERE id = ?",
-            (telegram_id, phone, account_id)
+            "UPDATE web_accounts SET telegram_id = ?, phone = ?, phone_normalized = ? WHERE id = ?",
+            (telegram_id, phone, _norm_phone(phone), account_id)
         )
         await db.commit()
-        
+
         return {"success": True, "account_id": account_id}
 
 async def check_code_verified(code: str) -> dict:
     """Check if verification code was verified by bot"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
+    async with get_db() as db:
         cursor = await db.execute(
-            """SELECT wv.verified, wv.telegram_id, wv.phone, wa.nickname, wa.name, wa.role 
-               FROM web_verification_codes wv 
-               JOIN web_accounts wa ON wv.account_id = wa.id 
+            """SELECT wv.verified, wv.telegram_id, wa.nickname, wa.name, wa.role
+               FROM web_verification_codes wv
+               JOIN web_accounts wa ON wv.account_id = wa.id
                WHERE wv.code = ?""",
             (code,)
         )
         row = await cursor.fetchone()
-        
+
         if not row:
             return {"verified": False}
-        
-        if row["verified"]:
+
+        verified, telegram_id, nickname, name, role = row
+        if verified:
             return {
                 "verified": True,
-                "nickname": row["nickname"],
-                "name": row["name"],
-                "role": row["role"],
-                "telegram_id": row["telegram_id"]
+                "nickname": nickname,
+                "name": name,
+                "role": role,
+                "telegram_id": telegram_id
             }
         return {"verified": False}
 
+_ACCOUNT_COLUMNS = (
+    "id", "nickname", "name", "role", "telegram_id",
+    "avatar_url", "original_avatar_url",
+)
+
 async def get_account_by_id(account_id: int) -> dict:
-    async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT * FROM web_accounts WHERE id = ?", (account_id,))
+    async with get_db() as db:
+        # Только то, что реально читают обработчики web_app; словарь
+        # собираем zip-ом по фиксированному порядку колонок
+        cursor = await db.execute(
+            """SELECT id, nickname, name, role, telegram_id,
+                      avatar_url, original_avatar_url
+               FROM web_accounts WHERE id = ?""",
+            (account_id,)
+        )
         row = await cursor.fetchone()
         if row:
-            return dict(row)
+            return dict(zip(_ACCOUNT_COLUMNS, row))
         return None
 
 # ============= SELLER VERIFICATION =============
@@ -1341,7 +1966,9 @@ async def get_account_by_id(account_id: int) -> dict:
 async def generate_seller_code(telegram_id: int) -> str:
     """Generate alphabetic code for seller verification"""
     code = generate_alpha_code(7)
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
+        # Старые коды гасим, чтобы у пользователя был один активный
+        await db.execute("DELETE FROM seller_codes WHERE telegram_id = ?", (telegram_id,))
         await db.execute(
             "INSERT INTO seller_codes (telegram_id, code) VALUES (?, ?)",
             (telegram_id, code)
@@ -1354,11 +1981,13 @@ async def verify_seller_code(code: str, account_id: int = None, telegram_id: int
     import logging
     logging.info(f"verify_seller_code called: code={code}, account_id={account_id}, telegram_id={telegram_id}")
     
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Find unused code (don't check telegram_id match - user might use different device)
+    async with get_db() as db:
+        # Find unused code (don't check telegram_id match - user might use different device).
+        # Коды хранятся в верхнем регистре — нормализуем ввод в Python,
+        # чтобы запрос попадал в частичный индекс вместо LOWER() на каждой строке
         cursor = await db.execute(
-            "SELECT id, telegram_id FROM seller_codes WHERE LOWER(code) = LOWER(?) AND used = 0",
-            (code,)
+            "SELECT id, telegram_id FROM seller_codes WHERE code = ? AND used = 0",
+            (code.upper(),)
         )
         row = await cursor.fetchone()
         
@@ -1396,18 +2025,15 @@ async def verify_seller_code(code: str, account_id: int = None, telegram_id: int
 async def generate_bot_verification_code(telegram_id: int, phone: str) -> str:
     """Bot generates code and sends to user. User will enter this on website."""
     code = generate_numeric_code(6)
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Store the code
-        await db.execute(
-            "INSERT OR REPLACE INTO bot_verification_codes (telegram_id, phone, code, created_at) VALUES (?, ?, ?, datetime('now'))",
-            (telegram_id, phone, code)
-        )
-        await db.commit()
+    await write(
+        "INSERT OR REPLACE INTO bot_verification_codes (telegram_id, phone, code, created_at) VALUES (?, ?, ?, datetime('now'))",
+        (telegram_id, phone, code)
+    )
     return code
 
 async def verify_bot_code(code: str, account_id: int = None) -> dict:
     """User enters code on website. Link phone to account."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT telegram_id, phone FROM bot_verification_codes WHERE code = ? AND used = 0",
             (code,)
@@ -1425,8 +2051,8 @@ async def verify_bot_code(code: str, account_id: int = None) -> dict:
         # Link to account if provided
         if account_id:
             await db.execute(
-                "UPDATE web_accounts SET telegram_id = ?, phone = ? WHERE id = ?",
-                (telegram_id, phone, account_id)
+                "UPDATE web_accounts SET telegram_id = ?, phone = ?, phone_normalized = ? WHERE id = ?",
+                (telegram_id, phone, _norm_phone(phone), account_id)
             )
         
         await db.commit()
@@ -1434,12 +2060,12 @@ async def verify_bot_code(code: str, account_id: int = None) -> dict:
 
 async def is_phone_registered(phone: str) -> bool:
     """Check if phone number is already registered"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Clean phone number
-        clean_phone = phone.replace('+', '').replace(' ', '').replace('-', '')
+    async with get_db() as db:
+        # Сравниваем с предвычисленной колонкой вместо тройного REPLACE()
+        # по каждой строке — запрос идёт через idx_wa_phone_norm
         cursor = await db.execute(
-            "SELECT id FROM web_accounts WHERE REPLACE(REPLACE(REPLACE(phone, '+', ''), ' ', ''), '-', '') = ?",
-            (clean_phone,)
+            "SELECT id FROM web_accounts WHERE phone_normalized = ?",
+            (_norm_phone(phone),)
         )
         row = await cursor.fetchone()
         return row is not None
@@ -1448,18 +2074,18 @@ async def is_phone_registered(phone: str) -> bool:
 
 async def delete_all_posts():
     """Admin function to clear all market posts"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM market_posts")
+    async with get_db() as db:
+        # rowcount уже известен курсору — отдельный SELECT changes() лишний
+        cursor = await db.execute("DELETE FROM market_posts")
+        count = cursor.rowcount
         await db.commit()
-        cursor = await db.execute("SELECT changes()")
-        row = await cursor.fetchone()
-        return row[0] if row else 0
+        return count
 
 # ============= REVIEWS =============
 
 async def add_review(from_user_id: int, to_user_id: int, rating: int, comment: str = None, post_id: int = None, deal_id: int = None):
     """Add a review for a user"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         await db.execute(
             "INSERT INTO reviews (from_user_id, to_user_id, rating, comment, post_id, deal_id) VALUES (?, ?, ?, ?, ?, ?)",
             (from_user_id, to_user_id, rating, comment, post_id, deal_id)
@@ -1468,7 +2094,7 @@ async def add_review(from_user_id: int, to_user_id: int, rating: int, comment: s
 
 async def get_user_reviews(user_id: int):
     """Get all reviews for a user"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             """SELECT r.*, wa.nickname as from_nickname, wa.name as from_name 
@@ -1483,7 +2109,7 @@ async def get_user_reviews(user_id: int):
 
 async def get_user_rating(user_id: int) -> dict:
     """Get average rating and count for user"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT AVG(rating) as avg_rating, COUNT(*) as count FROM reviews WHERE to_user_id = ?",
             (user_id,)
@@ -1495,28 +2121,30 @@ async def get_user_rating(user_id: int) -> dict:
 
 async def get_public_profile(user_id: int) -> dict:
     """Get public profile data for a user"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             "SELECT id, nickname, name, role, avatar_url, created_at FROM web_accounts WHERE id = ?",
             (user_id,)
         )
         row = await cursor.fetchone()
-        if not row:
-            return None
-        
-        profile = dict(row)
-        
-        # Get rating
-        rating_data = await get_user_rating(user_id)
-        profile['rating'] = rating_data['rating']
-        profile['review_count'] = rating_data['count']
-        
-        return profile
+
+    if not row:
+        return None
+
+    profile = dict(row)
+
+    # Get rating (outside the connection block - get_user_rating takes
+    # the shared connection itself)
+    rating_data = await get_user_rating(user_id)
+    profile['rating'] = rating_data['rating']
+    profile['review_count'] = rating_data['count']
+
+    return profile
 
 async def get_user_posts(user_id: int):
     """Get all posts by a user"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         # Try to get by web account id first
         cursor = await db.execute(
@@ -1537,7 +2165,7 @@ async def get_user_posts(user_id: int):
 
 async def create_deal(client_id: int, exchanger_id: int, rate: str, location: str, request_id: int = None, offer_id: int = None):
     """Create a new deal"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         cursor = await db.execute(
             "INSERT INTO deals (client_id, exchanger_id, rate, location, request_id, offer_id, status) VALUES (?, ?, ?, ?, ?, ?, 'confirmed')",
             (client_id, exchanger_id, rate, location, request_id, offer_id)
@@ -1548,7 +2176,7 @@ async def create_deal(client_id: int, exchanger_id: int, rate: str, location: st
 
 async def get_deal(deal_id: int):
     """Get deal by ID"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("SELECT * FROM deals WHERE id = ?", (deal_id,))
         row = await cursor.fetchone()
@@ -1556,58 +2184,34 @@ async def get_deal(deal_id: int):
 
 async def mark_ticket_sent(deal_id: int):
     """Mark that ticket was sent for deal"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE deals SET ticket_sent = 1 WHERE id = ?", (deal_id,))
-        await db.commit()
-
-# ============= SELLER CODES =============
-
-async def generate_seller_code(telegram_id: int) -> str:
-    """Generate alphabetic seller code for user"""
-    import random
-    import string
-    # Generate 7-character alphabetic code
-    code = ''.join(random.choices(string.ascii_uppercase, k=7))
-    
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Delete old codes for this user
-        await db.execute("DELETE FROM seller_codes WHERE telegram_id = ?", (telegram_id,))
-        # Insert new code
-        await db.execute(
-            "INSERT INTO seller_codes (telegram_id, code) VALUES (?, ?)",
-            (telegram_id, code)
-        )
-        await db.commit()
-    
-    return code
+    await write("UPDATE deals SET ticket_sent = 1 WHERE id = ?", (deal_id,))
 
 # ============= ADMIN: CLEAR ALL ORDERS =============
 
 async def clear_all_orders() -> int:
     """Delete all orders - returns count of deleted"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         await db.execute("DELETE FROM bids")  # Delete bids first (foreign key)
-        await db.execute("DELETE FROM orders")
+        cursor = await db.execute("DELETE FROM orders")
+        # SELECT changes() после третьего DELETE считал dismissed_orders,
+        # а не заявки; rowcount курсора отдаёт нужное число без roundtrip
+        count = cursor.rowcount
         await db.execute("DELETE FROM dismissed_orders")  # Clean dismissed too
         await db.commit()
-        cursor = await db.execute("SELECT changes()")
-        row = await cursor.fetchone()
-        return row[0] if row else 0
+        return count
 
 # ============= EXCHANGER: DISMISS ORDER =============
 
 async def dismiss_order(exchanger_id: int, order_id: int):
     """Mark order as dismissed by this exchanger"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO dismissed_orders (exchanger_id, order_id) VALUES (?, ?)",
-            (exchanger_id, order_id)
-        )
-        await db.commit()
+    await write(
+        "INSERT OR IGNORE INTO dismissed_orders (exchanger_id, order_id) VALUES (?, ?)",
+        (exchanger_id, order_id)
+    )
 
 async def is_order_dismissed(exchanger_id: int, order_id: int) -> bool:
     """Check if order was dismissed by this exchanger"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT 1 FROM dismissed_orders WHERE exchanger_id = ? AND order_id = ?",
             (exchanger_id, order_id)
@@ -1617,9 +2221,7 @@ async def is_order_dismissed(exchanger_id: int, order_id: int) -> bool:
 
 async def clear_dismissed_for_order(order_id: int):
     """Clear all dismissed records for an order (when client re-creates similar order)"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM dismissed_orders WHERE order_id = ?", (order_id,))
-        await db.commit()
+    await write("DELETE FROM dismissed_orders WHERE order_id = ?", (order_id,))
 
 # ============= ADMIN: EXCHANGER BAN MANAGEMENT =============
 
@@ -1629,7 +2231,7 @@ async def revoke_exchanger_status(telegram_id: int, ban_type: str = None, ban_ho
     ban_type: 'none' (can re-verify), 'temporary', 'permanent'
     ban_hours: hours for temporary ban
     """
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         # Remove exchanger status
         await db.execute(
             "UPDATE web_accounts SET role = 'client', is_seller_verified = 0 WHERE telegram_id = ?",
@@ -1656,12 +2258,13 @@ async def revoke_exchanger_status(telegram_id: int, ban_type: str = None, ban_ho
         else:
             # No ban - can re-verify immediately
             await db.execute("DELETE FROM exchanger_bans WHERE telegram_id = ?", (telegram_id,))
-        
+
         await db.commit()
+    _invalidate_user(telegram_id)
 
 async def check_exchanger_ban(telegram_id: int) -> dict:
     """Check if user is banned from becoming exchanger"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             "SELECT * FROM exchanger_bans WHERE telegram_id = ?",
@@ -1691,7 +2294,7 @@ async def check_exchanger_ban(telegram_id: int) -> dict:
 
 async def get_all_exchangers() -> list:
     """Get all users with exchanger role"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("""
             SELECT wa.id, wa.telegram_id, wa.nickname, wa.name, wa.role, wa.is_seller_verified
@@ -1701,3 +2304,16 @@ async def get_all_exchangers() -> list:
         rows = await cursor.fetchall()
         return [dict(row) for row in rows]
 
+async def get_exchanger_by_telegram_id(telegram_id: int) -> dict:
+    """Get one exchanger row directly instead of scanning get_all_exchangers()"""
+    async with get_db() as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(
+            """SELECT id, telegram_id, nickname, name, role, is_seller_verified
+               FROM web_accounts
+               WHERE telegram_id = ? AND (role = 'exchanger' OR is_seller_verified = 1)""",
+            (telegram_id,)
+        )
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
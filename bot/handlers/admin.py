@@ -1,33 +1,57 @@
-import aiosqlite
+import asyncio
+
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from config import ADMIN_IDS
-from bot.database.database import DB_NAME
+from bot.database.database import DB_NAME, get_db
 from bot.keyboards.main_menu import get_main_menu_keyboard
 
 router = Router()
 
+# Проверка на каждом клике — держим id в frozenset, а не в списке
+_ADMIN_ID_SET = frozenset(ADMIN_IDS)
+
 def is_admin(user_id: int) -> bool:
-    return user_id in ADMIN_IDS
+    return user_id in _ADMIN_ID_SET
 
 
 # ==================== ADMIN PANEL KEYBOARDS ====================
+# Статичные клавиатуры иммутабельны — строим один раз на импорте,
+# а не на каждое нажатие кнопки
+
+_ADMIN_PANEL_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📊 Статистика", callback_data="adm:stats")],
+    [InlineKeyboardButton(text="📋 Посты", callback_data="adm:posts")],
+    [InlineKeyboardButton(text="📝 Заявки", callback_data="adm:orders")],
+    [InlineKeyboardButton(text="👥 Обменники", callback_data="adm:exchangers")],
+    [InlineKeyboardButton(text="📢 Рассылка", callback_data="adm:broadcast")],
+    [InlineKeyboardButton(text="📦 Экспорт БД", callback_data="adm:export")],
+    [InlineKeyboardButton(text="🗑 Полная очистка", callback_data="adm:clearall")],
+    [InlineKeyboardButton(text="❌ Закрыть", callback_data="adm:close")],
+])
+
+_STATS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔄 Обновить", callback_data="adm:stats")],
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="adm:back")],
+])
+
+_POSTS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🗑 Удалить все посты", callback_data="adm:clear_posts")],
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="adm:back")],
+])
+
+_ORDERS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🗑 Удалить все заявки", callback_data="adm:clear_orders")],
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="adm:back")],
+])
+
 
 def get_admin_panel_keyboard():
     """Main admin panel keyboard"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📊 Статистика", callback_data="adm:stats")],
-        [InlineKeyboardButton(text="📋 Посты", callback_data="adm:posts")],
-        [InlineKeyboardButton(text="📝 Заявки", callback_data="adm:orders")],
-        [InlineKeyboardButton(text="👥 Обменники", callback_data="adm:exchangers")],
-        [InlineKeyboardButton(text="📢 Рассылка", callback_data="adm:broadcast")],
-        [InlineKeyboardButton(text="📦 Экспорт БД", callback_data="adm:export")],
-        [InlineKeyboardButton(text="🗑 Полная очистка", callback_data="adm:clearall")],
-        [InlineKeyboardButton(text="❌ Закрыть", callback_data="adm:close")],
-    ])
+    return _ADMIN_PANEL_KB
 
 
 # ==================== OPEN ADMIN PANEL ====================
@@ -91,31 +115,29 @@ async def admin_stats(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         return await callback.answer("❌ Нет прав", show_alert=True)
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT COUNT(*) FROM users") as cursor:
-            total_users = (await cursor.fetchone())[0]
-        async with db.execute("SELECT COUNT(*) FROM users WHERE session_string IS NOT NULL") as cursor:
-            active_users = (await cursor.fetchone())[0]
-        try:
-            async with db.execute("SELECT COUNT(*) FROM web_accounts") as cursor:
-                web_accounts = (await cursor.fetchone())[0]
-        except:
-            web_accounts = 0
-        try:
-            async with db.execute("SELECT COUNT(*) FROM market_posts") as cursor:
-                posts = (await cursor.fetchone())[0]
-        except:
-            posts = 0
-        try:
-            async with db.execute("SELECT COUNT(*) FROM orders") as cursor:
-                orders = (await cursor.fetchone())[0]
-        except:
-            orders = 0
+    async with get_db() as db:
+        # Все счётчики одним запросом: шесть отдельных execute - это шесть
+        # прыжков в рабочий поток aiosqlite на каждое обновление панели
         try:
-            async with db.execute("SELECT COUNT(*) FROM web_accounts WHERE role = 'exchanger' OR is_seller_verified = 1") as cursor:
-                exchangers = (await cursor.fetchone())[0]
+            async with db.execute(
+                """SELECT
+                       (SELECT COUNT(*) FROM users),
+                       (SELECT COUNT(*) FROM users WHERE session_string IS NOT NULL),
+                       (SELECT COUNT(*) FROM web_accounts),
+                       (SELECT COUNT(*) FROM market_posts),
+                       (SELECT COUNT(*) FROM orders),
+                       (SELECT COUNT(*) FROM web_accounts
+                        WHERE role = 'exchanger' OR is_seller_verified = 1)"""
+            ) as cursor:
+                total_users, active_users, web_accounts, posts, orders, exchangers = \
+                    await cursor.fetchone()
         except:
-            exchangers = 0
+            # Свежая база без части таблиц - считаем хотя бы пользователей
+            async with db.execute("SELECT COUNT(*) FROM users") as cursor:
+                total_users = (await cursor.fetchone())[0]
+            async with db.execute("SELECT COUNT(*) FROM users WHERE session_string IS NOT NULL") as cursor:
+                active_users = (await cursor.fetchone())[0]
+            web_accounts = posts = orders = exchangers = 0
 
     await callback.message.edit_text(
         "📊 <b>Статистика</b>\n\n"
@@ -126,10 +148,7 @@ async def admin_stats(callback: types.CallbackQuery):
         f"📋 Постов: <b>{posts}</b>\n"
         f"📝 Заявок: <b>{orders}</b>",
         parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔄 Обновить", callback_data="adm:stats")],
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="adm:back")],
-        ])
+        reply_markup=_STATS_KB
     )
     await callback.answer()
 
@@ -145,10 +164,7 @@ async def admin_posts(callback: types.CallbackQuery):
         "📋 <b>Управление постами</b>\n\n"
         "Посты - объявления обменников на сайте.",
         parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🗑 Удалить все посты", callback_data="adm:clear_posts")],
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="adm:back")],
-        ])
+        reply_markup=_POSTS_KB
     )
     await callback.answer()
 
@@ -177,7 +193,7 @@ async def admin_do_clear_posts(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         return await callback.answer("❌ Нет прав", show_alert=True)
     
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with get_db() as db:
         await db.execute("DELETE FROM market_posts")
         await db.commit()
     
@@ -202,10 +218,7 @@ async def admin_orders(callback: types.CallbackQuery):
         "📝 <b>Управление заявками</b>\n\n"
         "Заявки - запросы клиентов на обмен.",
         parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🗑 Удалить все заявки", callback_data="adm:clear_orders")],
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="adm:back")],
-        ])
+        reply_markup=_ORDERS_KB
     )
     await callback.answer()
 
@@ -298,10 +311,9 @@ async def admin_exchanger_detail(callback: types.CallbackQuery):
     
     telegram_id = int(callback.data.split(":")[2])
     
-    from bot.database.database import get_all_exchangers
-    exchangers = await get_all_exchangers()
-    ex = next((e for e in exchangers if e.get('telegram_id') == telegram_id), None)
-    
+    from bot.database.database import get_exchanger_by_telegram_id
+    ex = await get_exchanger_by_telegram_id(telegram_id)
+
     if not ex:
         return await callback.answer("❌ Не найден", show_alert=True)
     
@@ -406,21 +418,43 @@ async def process_broadcast(message: types.Message, state: FSMContext, bot):
         await message.answer("❌ Нужно отправить текст.")
         return
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT telegram_id FROM users") as cursor:
-            users = await cursor.fetchall()
-
+    # Шлём параллельно, но не больше 25 сообщений в секунду
+    # (глобальный лимит Telegram — 30/с)
+    sem = asyncio.Semaphore(25)
+
+    async def _send(uid):
+        async with sem:
+            try:
+                await bot.send_message(uid, text)
+                return 1
+            except Exception:
+                return 0
+            finally:
+                await asyncio.sleep(1)  # держим слот секунду => ~25 msg/s
+
+    # Получателей читаем порциями по 500 через keyset-пагинацию, а не
+    # fetchall(): память константная, первая отправка уходит сразу, и
+    # общее соединение не занято на всё время рассылки
     count = 0
-    for user in users:
-        try:
-            await bot.send_message(user[0], text)
-            count += 1
-        except Exception:
-            pass
+    total = 0
+    last_id = 0
+    while True:
+        async with get_db() as db:
+            async with db.execute(
+                "SELECT telegram_id FROM users WHERE telegram_id > ? ORDER BY telegram_id LIMIT 500",
+                (last_id,)
+            ) as cursor:
+                chunk = await cursor.fetchall()
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        total += len(chunk)
+        results = await asyncio.gather(*[_send(row[0]) for row in chunk])
+        count += sum(results)
 
     await message.answer(
         f"✅ <b>Рассылка завершена!</b>\n\n"
-        f"Отправлено: {count} из {len(users)}",
+        f"Отправлено: {count} из {total}",
         parse_mode="HTML",
         reply_markup=get_admin_panel_keyboard()
     )
@@ -429,15 +463,44 @@ async def process_broadcast(message: types.Message, state: FSMContext, bot):
 
 # ==================== EXPORT DB ====================
 
+def _backup_db(dest_path: str):
+    """Снять консистентную копию базы через online backup API.
+
+    Отправлять живой файл нельзя: при WAL часть данных лежит в -wal,
+    и выгрузка посреди записи даёт битый бэкап.
+    """
+    import sqlite3 as _sqlite3
+    src = _sqlite3.connect(DB_NAME)
+    try:
+        dst = _sqlite3.connect(dest_path)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
 @router.callback_query(F.data == "adm:export")
 async def admin_export(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         return await callback.answer("❌ Нет прав", show_alert=True)
-    
-    file = types.FSInputFile(DB_NAME)
+
+    # Бэкап делается в пуле потоков — бот продолжает отвечать,
+    # а backup API не блокирует других писателей надолго
+    backup_path = f"{DB_NAME}.backup"
+    await asyncio.to_thread(_backup_db, backup_path)
+
+    file = types.FSInputFile(backup_path, filename=DB_NAME)
     await callback.message.answer_document(file, caption="📦 Backup базы данных")
     await callback.answer("Файл отправлен!")
 
+    import os
+    try:
+        os.remove(backup_path)
+    except OSError:
+        pass
+
 
 # ==================== FULL CLEAR ====================
 
@@ -470,20 +533,23 @@ async def admin_do_clearall(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         return await callback.answer("❌ Нет прав", show_alert=True)
     
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM market_posts")
-        await db.execute("DELETE FROM web_accounts")
-        admin_ids_str = ",".join(str(id) for id in ADMIN_IDS)
-        await db.execute(f"DELETE FROM users WHERE telegram_id NOT IN ({admin_ids_str})")
-        await db.execute("DELETE FROM web_verification_codes")
-        await db.execute("DELETE FROM seller_codes")
-        await db.execute("DELETE FROM bot_verification_codes")
-        try:
-            await db.execute("DELETE FROM orders")
-            await db.execute("DELETE FROM bids")
-        except:
-            pass
-        await db.commit()
+    # Подстраховка от инъекции в f-строку ниже: id должны быть числами
+    admin_ids_str = ",".join(str(int(id)) for id in ADMIN_IDS)
+    async with get_db() as db:
+        # Один executescript: восемь DELETE уходят в executor-поток одним
+        # вызовом и коммитятся одной транзакцией вместо восьми переходов
+        await db.executescript(f"""
+            BEGIN IMMEDIATE;
+            DELETE FROM market_posts;
+            DELETE FROM web_accounts;
+            DELETE FROM users WHERE telegram_id NOT IN ({admin_ids_str});
+            DELETE FROM web_verification_codes;
+            DELETE FROM seller_codes;
+            DELETE FROM bot_verification_codes;
+            DELETE FROM orders;
+            DELETE FROM bids;
+            COMMIT;
+        """)
     
     await callback.message.edit_text(
         "🗑 <b>Очистка завершена!</b>\n\n"
@@ -1,19 +1,51 @@
 from aiogram import Router, F, types
 from aiogram.filters import Command, CommandObject
 from aiogram.types import ChatPermissions, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from bot.services.time_util import parse_time_string
+from bot.services import outbound
+import asyncio
+import logging
 import time
 
 router = Router()
 
-# Bot admin IDs
-ADMIN_IDS = [5912983856]  # Add your admin Telegram IDs
+# Bot admin IDs; frozenset — проверка на каждом колбэке
+ADMIN_IDS: frozenset[int] = frozenset({5912983856})  # Add your admin Telegram IDs
 
 def is_bot_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
+# Ссылки на фоновые задачи — иначе event loop может собрать их до завершения
+_bg_tasks: set = set()
+
+# Смещение wallclock к монотонным часам: unix-время считается одним
+# сложением, смещение освежается раз в пять минут на случай NTP-дрейфа
+_wall_offset = time.time() - time.monotonic()
+_wall_offset_ts = time.monotonic()
+
+def _wall_now() -> float:
+    global _wall_offset, _wall_offset_ts
+    now_mono = time.monotonic()
+    if now_mono - _wall_offset_ts > 300:
+        _wall_offset = time.time() - now_mono
+        _wall_offset_ts = now_mono
+    return now_mono + _wall_offset
+
+# Защита от даблкликов: пока тяжёлая операция идёт, повторное нажатие
+# той же кнопки тем же админом получает мгновенный ответ и не запускает
+# второй DELETE
+_inflight: set[tuple[int, str]] = set()
+
+def _acquire_inflight(callback: CallbackQuery):
+    key = (callback.from_user.id, callback.data)
+    if key in _inflight:
+        return None
+    _inflight.add(key)
+    return key
+
 
 # ==================== GROUP ADMIN COMMANDS ====================
 
@@ -22,9 +54,31 @@ def get_target_user(message: types.Message):
         return message.reply_to_message.from_user
     return None
 
+# Статус админа в чате меняется редко — кэшируем ответ get_member на
+# минуту и не ходим в Telegram на каждую подряд идущую команду
+_ADMIN_STATUS_TTL = 60
+_admin_status_cache: dict[tuple[int, int], tuple[float, bool]] = {}
+
 async def is_admin(message: types.Message):
+    key = (message.chat.id, message.from_user.id)
+    rec = _admin_status_cache.get(key)
+    if rec and time.monotonic() - rec[0] < _ADMIN_STATUS_TTL:
+        return rec[1]
     member = await message.chat.get_member(message.from_user.id)
-    return member.status in ["administrator", "creator"]
+    ok = member.status in ["administrator", "creator"]
+    if len(_admin_status_cache) > 10_000:
+        _admin_status_cache.clear()
+    _admin_status_cache[key] = (time.monotonic(), ok)
+    return ok
+
+# restrict() не мутирует permissions — pydantic-модели собираем один раз
+_PERM_MUTE = ChatPermissions(can_send_messages=False)
+_PERM_UNMUTE = ChatPermissions(
+    can_send_messages=True,
+    can_send_media_messages=True,
+    can_send_other_messages=True,
+    can_send_polls=True
+)
 
 @router.message(Command("ban"))
 async def cmd_ban(message: types.Message):
@@ -52,10 +106,27 @@ async def cmd_kick(message: types.Message):
     
     try:
         await message.chat.ban(target.id)
-        await message.chat.unban(target.id)
-        await message.reply(f"👢 Пользователь {target.full_name} был выгнан.")
     except Exception as e:
-        await message.reply(f"❌ Не удалось выгнать: {e}")
+        return await message.reply(f"❌ Не удалось выгнать: {e}")
+
+    # Разбан не обязан задерживать ответ админу — пускаем фоном,
+    # с одним повтором на случай гонки сразу после бана
+    async def _unban(chat=message.chat, user_id=target.id):
+        for attempt in (0, 1):
+            try:
+                await chat.unban(user_id, only_if_banned=True)
+                return
+            except Exception as e:
+                if attempt:
+                    logging.warning(f"Failed to unban kicked user {user_id}: {e}")
+                else:
+                    await asyncio.sleep(1)
+
+    task = asyncio.create_task(_unban())
+    _bg_tasks.add(task)
+    task.add_done_callback(_bg_tasks.discard)
+
+    await message.reply(f"👢 Пользователь {target.full_name} был выгнан.")
 
 @router.message(Command("mute"))
 async def cmd_mute(message: types.Message, command: CommandObject):
@@ -70,11 +141,10 @@ async def cmd_mute(message: types.Message, command: CommandObject):
     if command.args:
         duration = parse_time_string(command.args)
     
-    permissions = ChatPermissions(can_send_messages=False)
-    until_date = int(time.time()) + duration if duration > 0 else None
-    
+    until_date = int(_wall_now()) + duration if duration > 0 else None
+
     try:
-        await message.chat.restrict(target.id, permissions=permissions, until_date=until_date)
+        await message.chat.restrict(target.id, permissions=_PERM_MUTE, until_date=until_date)
         time_str = f"на {command.args}" if duration > 0 else "навсегда"
         await message.reply(f"🔇 Пользователь {target.full_name} заглушен {time_str}.")
     except Exception as e:
@@ -89,51 +159,77 @@ async def cmd_unmute(message: types.Message):
     if not target:
         return await message.reply("⚠️ Ответьте на сообщение пользователя.")
     
-    permissions = ChatPermissions(
-        can_send_messages=True,
-        can_send_media_messages=True,
-        can_send_other_messages=True,
-        can_send_polls=True
-    )
-    
     try:
-        await message.chat.restrict(target.id, permissions=permissions)
+        await message.chat.restrict(target.id, permissions=_PERM_UNMUTE)
         await message.reply(f"🔊 С пользователя {target.full_name} сняты ограничения.")
     except Exception as e:
         await message.reply(f"❌ Не удалось размутить: {e}")
 
 
 # ==================== ADMIN PANEL (INLINE BUTTONS) ====================
+# Статичные клавиатуры — это иммутабельные pydantic-модели; собираем их
+# один раз на импорте вместо валидации на каждом нажатии
+
+_ADMIN_PANEL_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📋 Посты", callback_data="admin:posts_menu")],
+    [InlineKeyboardButton(text="📝 Заявки", callback_data="admin:orders_menu")],
+    [InlineKeyboardButton(text="👥 Обменники", callback_data="admin:exchangers_menu")],
+    [InlineKeyboardButton(text="❌ Закрыть", callback_data="admin:close")],
+])
+
+_POSTS_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🗑 Удалить все посты", callback_data="admin:clear_posts")],
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="admin:back")],
+])
+
+_ORDERS_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🗑 Удалить все заявки", callback_data="admin:clear_orders")],
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="admin:back")],
+])
+
+_EXCHANGERS_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📋 Список обменников", callback_data="admin:list_exchangers")],
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="admin:back")],
+])
+
+_CONFIRM_CLEAR_POSTS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="✅ Да, удалить", callback_data="admin:confirm_clear_posts"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="admin:posts_menu")
+    ],
+])
+
+_CONFIRM_CLEAR_ORDERS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="✅ Да, удалить", callback_data="admin:confirm_clear_orders"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="admin:orders_menu")
+    ],
+])
+
+_BACK_TO_POSTS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="admin:posts_menu")],
+])
+
+_BACK_TO_ORDERS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="admin:orders_menu")],
+])
+
 
 def get_admin_panel_keyboard():
     """Main admin panel keyboard"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📋 Посты", callback_data="admin:posts_menu")],
-        [InlineKeyboardButton(text="📝 Заявки", callback_data="admin:orders_menu")],
-        [InlineKeyboardButton(text="👥 Обменники", callback_data="admin:exchangers_menu")],
-        [InlineKeyboardButton(text="❌ Закрыть", callback_data="admin:close")],
-    ])
+    return _ADMIN_PANEL_KB
 
 def get_posts_menu_keyboard():
     """Posts management menu"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🗑 Удалить все посты", callback_data="admin:clear_posts")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="admin:back")],
-    ])
+    return _POSTS_MENU_KB
 
 def get_orders_menu_keyboard():
     """Orders management menu"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🗑 Удалить все заявки", callback_data="admin:clear_orders")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="admin:back")],
-    ])
+    return _ORDERS_MENU_KB
 
 def get_exchangers_menu_keyboard():
     """Exchangers management menu"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📋 Список обменников", callback_data="admin:list_exchangers")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="admin:back")],
-    ])
+    return _EXCHANGERS_MENU_KB
 
 
 @router.message(Command("admin"))
@@ -150,22 +246,45 @@ async def cmd_admin_panel(message: types.Message):
     )
 
 
-@router.callback_query(F.data == "admin:back")
+# Последний отрисованный текст по message_id: повторная навигация в тот
+# же раздел иначе шлёт идентичный edit_text, который Telegram отвергает
+# с MESSAGE_NOT_MODIFIED — впустую потраченный вызов
+_last_render: dict[int, str] = {}
+
+async def _edit_panel(callback: CallbackQuery, text: str, reply_markup):
+    mid = callback.message.message_id
+    if _last_render.get(mid) == text:
+        try:
+            await callback.message.edit_reply_markup(reply_markup=reply_markup)
+        except TelegramBadRequest:
+            pass  # и текст, и клавиатура не изменились — править нечего
+        return
+    if len(_last_render) > 1000:
+        _last_render.clear()
+    _last_render[mid] = text
+    await callback.message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+
+
+def _invalidate_render(callback: CallbackQuery):
+    """Сбросить запись о тексте перед edit_text в обход _edit_panel."""
+    _last_render.pop(callback.message.message_id, None)
+
+
 async def admin_back(callback: CallbackQuery):
     """Back to main admin menu"""
-    if not is_bot_admin(callback.from_user.id):
-        return await callback.answer("❌ Нет доступа", show_alert=True)
-    
-    await callback.message.edit_text(
+
+    # Сначала гасим спиннер на кнопке, потом рисуем меню — иначе
+    # пользователь видит "часики" всё время работы обработчика.
+    # cache_time: Telegram сам гасит повторные тапы по той же кнопке
+    await callback.answer(cache_time=2)
+    await _edit_panel(
+        callback,
         "🔧 <b>Админ-панель NellX</b>\n\n"
         "Выберите раздел:",
-        reply_markup=get_admin_panel_keyboard(),
-        parse_mode="HTML"
+        get_admin_panel_keyboard(),
     )
-    await callback.answer()
 
 
-@router.callback_query(F.data == "admin:close")
 async def admin_close(callback: CallbackQuery):
     """Close admin panel"""
     await callback.message.delete()
@@ -174,145 +293,157 @@ async def admin_close(callback: CallbackQuery):
 
 # ==================== POSTS MENU ====================
 
-@router.callback_query(F.data == "admin:posts_menu")
 async def admin_posts_menu(callback: CallbackQuery):
-    if not is_bot_admin(callback.from_user.id):
-        return await callback.answer("❌ Нет доступа", show_alert=True)
-    
-    await callback.message.edit_text(
+
+    await callback.answer(cache_time=2)
+    await _edit_panel(
+        callback,
         "📋 <b>Управление постами</b>\n\n"
         "Посты - это объявления от обменников на сайте.",
-        reply_markup=get_posts_menu_keyboard(),
-        parse_mode="HTML"
+        get_posts_menu_keyboard(),
     )
-    await callback.answer()
 
 
-@router.callback_query(F.data == "admin:clear_posts")
 async def admin_clear_posts(callback: CallbackQuery):
-    if not is_bot_admin(callback.from_user.id):
-        return await callback.answer("❌ Нет доступа", show_alert=True)
-    
-    # Confirm button
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="✅ Да, удалить", callback_data="admin:confirm_clear_posts"),
-            InlineKeyboardButton(text="❌ Отмена", callback_data="admin:posts_menu")
-        ],
-    ])
     
+    await callback.answer()
+
+    _invalidate_render(callback)
     await callback.message.edit_text(
         "⚠️ <b>Вы уверены?</b>\n\n"
         "Это удалит ВСЕ посты с сайта.\n"
         "Действие необратимо!",
-        reply_markup=keyboard,
+        reply_markup=_CONFIRM_CLEAR_POSTS_KB,
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
-@router.callback_query(F.data == "admin:confirm_clear_posts")
 async def admin_confirm_clear_posts(callback: CallbackQuery):
-    if not is_bot_admin(callback.from_user.id):
-        return await callback.answer("❌ Нет доступа", show_alert=True)
-    
-    from bot.database.database import delete_all_posts
-    count = await delete_all_posts()
     
-    await callback.message.edit_text(
-        f"✅ <b>Готово!</b>\n\n"
-        f"Удалено постов: {count}",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="admin:posts_menu")],
-        ]),
-        parse_mode="HTML"
-    )
-    await callback.answer("Посты удалены!")
+    key = _acquire_inflight(callback)
+    if key is None:
+        return await callback.answer("⏳ Уже выполняется...")
+
+    try:
+        # Ack сразу: на большой базе DELETE занимает секунды, а Telegram
+        # передоставляет неподтверждённые колбэки
+        await callback.answer()
+        _invalidate_render(callback)
+        await callback.message.edit_text("⏳ Удаляю посты...", parse_mode="HTML")
+
+        from bot.database.database import delete_all_posts
+        count = await delete_all_posts()
+
+        # Финальные правки сообщений идут через общую исходящую очередь:
+        # несколько админов в панели не выбивают боту 429
+        await outbound.send(lambda: callback.message.edit_text(
+            f"✅ <b>Готово!</b>\n\n"
+            f"Удалено постов: {count}",
+            reply_markup=_BACK_TO_POSTS_KB,
+            parse_mode="HTML"
+        ))
+    finally:
+        _inflight.discard(key)
 
 
 # ==================== ORDERS MENU ====================
 
-@router.callback_query(F.data == "admin:orders_menu")
 async def admin_orders_menu(callback: CallbackQuery):
-    if not is_bot_admin(callback.from_user.id):
-        return await callback.answer("❌ Нет доступа", show_alert=True)
     
-    await callback.message.edit_text(
+    await callback.answer(cache_time=2)
+    await _edit_panel(
+        callback,
         "📝 <b>Управление заявками</b>\n\n"
         "Заявки - это запросы клиентов на обмен валюты.",
-        reply_markup=get_orders_menu_keyboard(),
-        parse_mode="HTML"
+        get_orders_menu_keyboard(),
     )
-    await callback.answer()
 
 
-@router.callback_query(F.data == "admin:clear_orders")
 async def admin_clear_orders(callback: CallbackQuery):
-    if not is_bot_admin(callback.from_user.id):
-        return await callback.answer("❌ Нет доступа", show_alert=True)
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="✅ Да, удалить", callback_data="admin:confirm_clear_orders"),
-            InlineKeyboardButton(text="❌ Отмена", callback_data="admin:orders_menu")
-        ],
-    ])
     
+    await callback.answer()
+
+    _invalidate_render(callback)
     await callback.message.edit_text(
         "⚠️ <b>Вы уверены?</b>\n\n"
         "Это удалит ВСЕ заявки и ставки.\n"
         "Действие необратимо!",
-        reply_markup=keyboard,
+        reply_markup=_CONFIRM_CLEAR_ORDERS_KB,
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
-@router.callback_query(F.data == "admin:confirm_clear_orders")
 async def admin_confirm_clear_orders(callback: CallbackQuery):
-    if not is_bot_admin(callback.from_user.id):
-        return await callback.answer("❌ Нет доступа", show_alert=True)
-    
-    from bot.database.database import clear_all_orders
-    count = await clear_all_orders()
     
-    await callback.message.edit_text(
-        f"✅ <b>Готово!</b>\n\n"
-        f"Удалено записей: {count}",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="admin:orders_menu")],
-        ]),
-        parse_mode="HTML"
-    )
-    await callback.answer("Заявки удалены!")
+    key = _acquire_inflight(callback)
+    if key is None:
+        return await callback.answer("⏳ Уже выполняется...")
+
+    try:
+        await callback.answer()
+        _invalidate_render(callback)
+        await callback.message.edit_text("⏳ Удаляю заявки...", parse_mode="HTML")
+
+        from bot.database.database import clear_all_orders
+        count = await clear_all_orders()
+
+        await outbound.send(lambda: callback.message.edit_text(
+            f"✅ <b>Готово!</b>\n\n"
+            f"Удалено записей: {count}",
+            reply_markup=_BACK_TO_ORDERS_KB,
+            parse_mode="HTML"
+        ))
+    finally:
+        _inflight.discard(key)
 
 
 # ==================== EXCHANGERS MENU ====================
 
-@router.callback_query(F.data == "admin:exchangers_menu")
 async def admin_exchangers_menu(callback: CallbackQuery):
-    if not is_bot_admin(callback.from_user.id):
-        return await callback.answer("❌ Нет доступа", show_alert=True)
     
-    await callback.message.edit_text(
+    await callback.answer(cache_time=2)
+    await _edit_panel(
+        callback,
         "👥 <b>Управление обменниками</b>\n\n"
         "Здесь можно просмотреть список обменников и снять с них статус.",
-        reply_markup=get_exchangers_menu_keyboard(),
-        parse_mode="HTML"
+        get_exchangers_menu_keyboard(),
     )
-    await callback.answer()
 
 
-@router.callback_query(F.data == "admin:list_exchangers")
+# Короткий TTL-кэш списка обменников: просмотр списка и открытие
+# карточек при навигации админа не гоняют один и тот же SELECT
+_ex_cache = {"t": 0.0, "data": None, "by_id": {}}
+
+# Готовая клавиатура списка: pydantic-модели кнопок пересобираются
+# только когда состав списка реально изменился
+_ex_kb_cache = {"sig": None, "kb": None}
+
+async def _cached_exchangers(ttl: int = 30):
+    now = time.monotonic()
+    if _ex_cache["data"] is None or now - _ex_cache["t"] > ttl:
+        from bot.database.database import get_all_exchangers
+        data = await get_all_exchangers()
+        # Подпись кнопки и callback_data считаем один раз на выборку,
+        # а не на каждую перерисовку списка
+        for e in data:
+            e["_label"] = (e.get('name') or e.get('nickname') or 'N/A')[:20]
+            e["_cb"] = f"admin:exchanger:{e.get('telegram_id')}"
+        _ex_cache.update(
+            t=now, data=data,
+            by_id={e.get('telegram_id'): e for e in data},
+        )
+    return _ex_cache["data"], _ex_cache["by_id"]
+
+
 async def admin_list_exchangers(callback: CallbackQuery):
-    if not is_bot_admin(callback.from_user.id):
-        return await callback.answer("❌ Нет доступа", show_alert=True)
-    
-    from bot.database.database import get_all_exchangers
-    exchangers = await get_all_exchangers()
-    
+
+    await callback.answer(cache_time=2)
+    _invalidate_render(callback)
+
+    exchangers, _ = await _cached_exchangers()
+
     if not exchangers:
-        await callback.message.edit_text(
+        return await callback.message.edit_text(
             "📋 <b>Обменники</b>\n\n"
             "Нет зарегистрированных обменников.",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -320,45 +451,54 @@ async def admin_list_exchangers(callback: CallbackQuery):
             ]),
             parse_mode="HTML"
         )
-        return await callback.answer()
-    
-    # Create buttons for each exchanger
-    buttons = []
-    for ex in exchangers:
-        name = ex.get('name', ex.get('nickname', 'N/A'))[:20]
-        verified = "✅" if ex.get('is_seller_verified') else "❌"
-        buttons.append([
-            InlineKeyboardButton(
-                text=f"{verified} {name}",
-                callback_data=f"admin:exchanger:{ex.get('telegram_id')}"
-            )
-        ])
-    
-    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="admin:exchangers_menu")])
-    
+
+    # Клавиатура пересобирается только при изменении состава списка
+    sig = hash(tuple(
+        (ex.get('telegram_id'), ex.get('is_seller_verified'),
+         ex.get('name') or ex.get('nickname'))
+        for ex in exchangers
+    ))
+    if sig != _ex_kb_cache["sig"]:
+        buttons = []
+        for ex in exchangers:
+            verified = "✅ " if ex.get('is_seller_verified') else "❌ "
+            buttons.append([
+                InlineKeyboardButton(
+                    text=verified + ex["_label"],
+                    callback_data=ex["_cb"]
+                )
+            ])
+        buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="admin:exchangers_menu")])
+        _ex_kb_cache["sig"] = sig
+        _ex_kb_cache["kb"] = InlineKeyboardMarkup(inline_keyboard=buttons)
+
     await callback.message.edit_text(
         f"📋 <b>Обменники ({len(exchangers)})</b>\n\n"
         "Выберите обменника для управления:",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+        reply_markup=_ex_kb_cache["kb"],
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
-@router.callback_query(F.data.startswith("admin:exchanger:"))
 async def admin_exchanger_detail(callback: CallbackQuery):
-    if not is_bot_admin(callback.from_user.id):
-        return await callback.answer("❌ Нет доступа", show_alert=True)
-    
-    telegram_id = int(callback.data.split(":")[2])
-    
-    from bot.database.database import get_all_exchangers
-    exchangers = await get_all_exchangers()
-    exchanger = next((e for e in exchangers if e.get('telegram_id') == telegram_id), None)
-    
+
+    # rpartition вместо split: id стоит последним, список не нужен
+    telegram_id = int(callback.data.rpartition(":")[2])
+
+    _, by_id = await _cached_exchangers()
+    exchanger = by_id.get(telegram_id)
+    if not exchanger:
+        # Промах кэша (новый обменник за время TTL) — освежаем один раз
+        _ex_cache["t"] = 0.0
+        _, by_id = await _cached_exchangers()
+        exchanger = by_id.get(telegram_id)
+
     if not exchanger:
         return await callback.answer("❌ Обменник не найден", show_alert=True)
-    
+
+    await callback.answer(cache_time=2)
+    _invalidate_render(callback)
+
     name = exchanger.get('name', exchanger.get('nickname', 'N/A'))
     verified = "✅ Верифицирован" if exchanger.get('is_seller_verified') else "❌ Не верифицирован"
     
@@ -379,44 +519,91 @@ async def admin_exchanger_detail(callback: CallbackQuery):
         reply_markup=keyboard,
         parse_mode="HTML"
     )
-    await callback.answer()
 
 
-@router.callback_query(F.data.startswith("admin:revoke:"))
+def _parse_revoke(data: str):
+    """Разобрать "admin:revoke:<tid>:<action>[:<hours>]" одним проходом.
+
+    partition не аллоцирует список под все сегменты, как split.
+    """
+    _, _, rest = data.partition("admin:revoke:")
+    tid, _, tail = rest.partition(":")
+    action, _, hours = tail.partition(":")
+    return int(tid), action, (int(hours) if hours else None)
+
+
 async def admin_revoke_exchanger(callback: CallbackQuery):
+
+    key = _acquire_inflight(callback)
+    if key is None:
+        return await callback.answer("⏳ Уже выполняется...")
+
+    try:
+        await callback.answer()
+
+        telegram_id, action, hours = _parse_revoke(callback.data)
+
+        ban_type = None
+        ban_hours = None
+
+        if action == "perm":
+            ban_type = "permanent"
+            status_text = "🚫 Забанен навсегда"
+        elif action == "temp":
+            ban_type = "temporary"
+            ban_hours = hours
+            status_text = f"⏰ Бан на {ban_hours} часов"
+        else:
+            status_text = "✅ Может снова стать обменником"
+
+        from bot.database.database import revoke_exchanger_status
+        await revoke_exchanger_status(telegram_id, ban_type, ban_hours)
+        _ex_cache["t"] = 0.0  # статус изменился — кэш списка устарел
+
+        _invalidate_render(callback)
+        await outbound.send(lambda: callback.message.edit_text(
+            f"✅ <b>Статус снят</b>\n\n"
+            f"ID: <code>{telegram_id}</code>\n"
+            f"Результат: {status_text}",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="🔙 К списку", callback_data="admin:list_exchangers")],
+            ]),
+            parse_mode="HTML"
+        ))
+    finally:
+        _inflight.discard(key)
+
+
+# ==================== CALLBACK DISPATCH ====================
+
+# Один зарегистрированный обработчик вместо дюжины: aiogram проверяет
+# фильтры линейно на каждый апдейт, а здесь второй сегмент callback_data
+# находится за одну выборку из словаря. Проверка is_bot_admin тоже
+# делается один раз тут, а не в каждом обработчике.
+_ADMIN_DISPATCH = {
+    "back": admin_back,
+    "close": admin_close,
+    "posts_menu": admin_posts_menu,
+    "clear_posts": admin_clear_posts,
+    "confirm_clear_posts": admin_confirm_clear_posts,
+    "orders_menu": admin_orders_menu,
+    "clear_orders": admin_clear_orders,
+    "confirm_clear_orders": admin_confirm_clear_orders,
+    "exchangers_menu": admin_exchangers_menu,
+    "list_exchangers": admin_list_exchangers,
+    "exchanger": admin_exchanger_detail,
+    "revoke": admin_revoke_exchanger,
+}
+
+
+@router.callback_query(F.data.startswith("admin:"))
+async def admin_callback_root(callback: CallbackQuery):
     if not is_bot_admin(callback.from_user.id):
         return await callback.answer("❌ Нет доступа", show_alert=True)
-    
-    parts = callback.data.split(":")
-    telegram_id = int(parts[2])
-    action = parts[3]
-    
-    ban_type = None
-    ban_hours = None
-    
-    if action == "perm":
-        ban_type = "permanent"
-        status_text = "🚫 Забанен навсегда"
-    elif action == "temp":
-        ban_type = "temporary"
-        ban_hours = int(parts[4])
-        status_text = f"⏰ Бан на {ban_hours} часов"
-    else:
-        status_text = "✅ Может снова стать обменником"
-    
-    from bot.database.database import revoke_exchanger_status
-    await revoke_exchanger_status(telegram_id, ban_type, ban_hours)
-    
-    await callback.message.edit_text(
-        f"✅ <b>Статус снят</b>\n\n"
-        f"ID: <code>{telegram_id}</code>\n"
-        f"Результат: {status_text}",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 К списку", callback_data="admin:list_exchangers")],
-        ]),
-        parse_mode="HTML"
-    )
-    await callback.answer("Статус обменника снят!")
+
+    handler = _ADMIN_DISPATCH.get(callback.data.split(":", 2)[1])
+    if handler:
+        await handler(callback)
 
 
 # ==================== SELLER CODE (keep as command) ====================
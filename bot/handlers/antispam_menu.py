@@ -33,7 +33,7 @@ class SpamState(StatesGroup):
 @router.callback_query(F.data == "menu_spam")
 async def show_spam_menu(callback: types.CallbackQuery):
     user = await get_user(callback.from_user.id)
-    lang = user[2] if user else "ru"
+    lang = user["language"] if user else "ru"
     
     with suppress(TelegramBadRequest):
         await callback.message.edit_text(
@@ -60,7 +60,7 @@ async def on_bot_added_to_group(event: types.ChatMemberUpdated):
             logging.info(f"Added monitored chat {chat_title} for user {user_id}")
             
             # Send PM to user
-            lang = user[2]
+            lang = user["language"]
             try:
                 await event.bot.send_message(
                     chat_id=user_id,
@@ -80,7 +80,7 @@ async def on_bot_added_to_group(event: types.ChatMemberUpdated):
         user = await get_user(user_id)
         if user:
             await add_monitored_chat(user_id, chat_id, chat_title)
-            lang = user[2]
+            lang = user["language"]
             try:
                 await event.bot.send_message(
                     chat_id=user_id,
@@ -94,7 +94,7 @@ async def on_bot_added_to_group(event: types.ChatMemberUpdated):
 @router.callback_query(F.data == "spam_groups_list")
 async def show_groups_list(callback: types.CallbackQuery):
     user = await get_user(callback.from_user.id)
-    lang = user[2] if user else "ru"
+    lang = user["language"] if user else "ru"
     
     all_groups = await get_monitored_chats_full(callback.from_user.id)
     
@@ -157,7 +157,7 @@ async def save_keywords(message: types.Message, state: FSMContext):
     data = await state.get_data()
     chat_id = data.get("chat_id")
     user = await get_user(message.from_user.id)
-    lang = user[2] if user else "ru"
+    lang = user["language"] if user else "ru"
     
     text = message.text.strip()
     if text.lower() == "clear":
@@ -194,7 +194,7 @@ async def delete_group_from_list(callback: types.CallbackQuery):
 
 async def show_group_settings_menu(callback: types.CallbackQuery, chat_id: int):
     user = await get_user(callback.from_user.id)
-    lang = user[2] if user else "ru"
+    lang = user["language"] if user else "ru"
     
     settings = await get_spam_settings(chat_id)
     if not settings:
@@ -209,7 +209,7 @@ async def show_group_settings_menu(callback: types.CallbackQuery, chat_id: int):
 
 async def ask_flood_settings(callback: types.CallbackQuery, state: FSMContext, chat_id: int):
     user = await get_user(callback.from_user.id)
-    lang = user[2] if user else "ru"
+    lang = user["language"] if user else "ru"
     
     settings = await get_spam_settings(chat_id)
     max_msgs = settings["flood_max_msgs"] if settings else 0
@@ -245,7 +245,7 @@ async def toggle_links_handler(callback: types.CallbackQuery):
     
     # Refresh
     user = await get_user(callback.from_user.id)
-    lang = user[2] if user else "ru"
+    lang = user["language"] if user else "ru"
     # Re-fetch for clean dict
     settings = await get_spam_settings(chat_id)
     with suppress(TelegramBadRequest):
@@ -258,7 +258,7 @@ async def save_flood_settings(message: types.Message, state: FSMContext):
     data = await state.get_data()
     chat_id = data.get("chat_id")
     user = await get_user(message.from_user.id)
-    lang = user[2] if user else "ru"
+    lang = user["language"] if user else "ru"
     
     text = message.text.strip()
     if text == "0":
@@ -1,6 +1,6 @@
 import datetime
 from aiogram import Router, F, types
-from aiogram.types import InlineKeyboardButton
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from bot.database.database import get_user
 from bot.keyboards.main_menu import get_main_menu_keyboard
 from bot.services.rates_api import get_official_rates, get_binance_p2p_rates
@@ -39,11 +39,12 @@ async def update_dashboard_message(message: types.Message):
     text += f"\n⏱ Обновлено: {datetime.datetime.now().strftime('%H:%M:%S')}"
 
     user = await get_user(message.chat.id)
-    lang = user[2] if user else "ru"
+    lang = user["language"] if user else "ru"
 
-    keyboard = get_main_menu_keyboard(message.chat.id, lang)
+    # Нельзя дописывать строки в общий кэшированный markup — копируем
+    menu_kb = get_main_menu_keyboard(message.chat.id, lang)
     refresh_btn = InlineKeyboardButton(text="🔄 Обновить", callback_data="menu_analysis_dashboard")
-    keyboard.inline_keyboard = [[refresh_btn]] + keyboard.inline_keyboard
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[refresh_btn]] + menu_kb.inline_keyboard)
 
     try:
         await message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
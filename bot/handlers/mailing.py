@@ -180,7 +180,7 @@ async def save_template_name(message: types.Message, state: FSMContext):
 @router.callback_query(F.data == "mailing_start")
 async def start_mailing(callback: types.CallbackQuery, state: FSMContext):
     user = await get_user(callback.from_user.id)
-    if not user or not user[3]:
+    if not user or not user["session_string"]:
         await callback.answer("Сначала пройдите авторизацию /start", show_alert=True)
         return
 
@@ -218,17 +218,17 @@ async def delete_template_cb(callback: types.CallbackQuery, state: FSMContext):
 async def choose_template(callback: types.CallbackQuery, state: FSMContext):
     template_id = int(callback.data.split("_")[1])
     user = await get_user(callback.from_user.id)
-    if not user or not user[3]:
+    if not user or not user["session_string"]:
         await callback.answer("Сначала пройдите авторизацию /start", show_alert=True)
         return
 
     await state.set_state(MailingState.selecting_groups)
     await state.update_data(selected_template_id=template_id)
 
-    groups = await get_user_dialogs(callback.from_user.id, user[3], only_writable=True)
+    groups = await get_user_dialogs(callback.from_user.id, user["session_string"], only_writable=True)
     fallback_used = False
     if not groups:
-        groups = await get_user_dialogs(callback.from_user.id, user[3], only_writable=False)
+        groups = await get_user_dialogs(callback.from_user.id, user["session_string"], only_writable=False)
         fallback_used = bool(groups)
     if not groups:
         await callback.message.edit_text(
@@ -279,7 +279,7 @@ async def toggle_mailing_group(callback: types.CallbackQuery, state: FSMContext)
     # Verify is_forum status explicitly because get_dialogs might be incomplete
     from bot.services.client_manager import get_chat_info
     user = await get_user(callback.from_user.id)
-    chat_info = await get_chat_info(callback.from_user.id, user[3], group_id)
+    chat_info = await get_chat_info(callback.from_user.id, user["session_string"], group_id)
     
     is_forum = False
     if chat_info:
@@ -291,7 +291,7 @@ async def toggle_mailing_group(callback: types.CallbackQuery, state: FSMContext)
     # This handles cases where Telegram doesn't report is_forum correctly in initial calls
     if not is_forum and group and group.get("type") == "supergroup":
         # Try to fetch topics anyway
-        topics = await get_forum_topics(callback.from_user.id, user[3], group_id)
+        topics = await get_forum_topics(callback.from_user.id, user["session_string"], group_id)
         if topics:
             is_forum = True
             # Update local group info
@@ -301,7 +301,7 @@ async def toggle_mailing_group(callback: types.CallbackQuery, state: FSMContext)
     if is_forum:
         # Fetch topics (if not already fetched)
         if 'topics' not in locals():
-            topics = await get_forum_topics(callback.from_user.id, user[3], group_id)
+            topics = await get_forum_topics(callback.from_user.id, user["session_string"], group_id)
         
         if topics:
             await state.set_state(MailingState.selecting_topic)
@@ -575,7 +575,7 @@ async def confirm_mailing(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
 
     user = await get_user(callback.from_user.id)
-    lang = user[2] if user else "ru"
+    lang = user["language"] if user else "ru"
 
     from bot.services.time_util import format_seconds
     interval_str = format_seconds(interval)
@@ -8,7 +8,7 @@ router = Router()
 @router.callback_query(F.data == "menu_main")
 async def back_to_main(callback: types.CallbackQuery):
     user = await get_user(callback.from_user.id)
-    lang = user[2] if user else "ru"
+    lang = user["language"] if user else "ru"
     await callback.message.edit_text(
         "Главное меню / Asosiy menyu:", reply_markup=get_main_menu_keyboard(callback.from_user.id, lang)
     )
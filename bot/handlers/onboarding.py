@@ -1,17 +1,68 @@
+import asyncio
+import string
+from time import monotonic
+
 from aiogram import Router, F, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
+from config import WEBAPP_URL
 from bot.states.states import RegistrationState
 from bot.database.database import (
-    get_user_by_telegram_id, 
-    check_nickname_exists, 
-    register_user_via_bot
+    get_user_by_telegram_id,
+    check_nickname_exists,
+    register_user_via_bot,
+    generate_seller_code
 )
 from bot.keyboards.main_menu import get_main_menu_keyboard
 from bot.keyboards.onboarding import get_language_keyboard
 
 router = Router()
 
+# Короткий кэш аккаунта: /start и кнопки онбординга читают одну и ту же
+# строку web_accounts по несколько раз за считанные секунды
+_USER_CACHE_TTL = 60
+_user_cache: dict[int, tuple[float, dict]] = {}
+
+
+# Дедупликация повторных апдейтов: серия быстрых /start от одного
+# пользователя схлопывается в один ответ, а двойная отправка пароля не
+# запускает вторую регистрацию, пока считается bcrypt первой
+_START_DEDUP_TTL = 1.0
+_last_start: dict[int, float] = {}
+_reg_inflight: set[int] = set()
+
+# Ссылки на фоновые задачи — иначе event loop может собрать их до завершения
+_bg_tasks: set = set()
+
+
+async def _silent_delete(message: types.Message):
+    try:
+        await message.delete()
+    except Exception:
+        pass
+
+
+def _start_is_duplicate(telegram_id: int) -> bool:
+    now = monotonic()
+    if now - _last_start.get(telegram_id, 0.0) < _START_DEDUP_TTL:
+        return True
+    if len(_last_start) > 10_000:
+        _last_start.clear()
+    _last_start[telegram_id] = now
+    return False
+
+
+async def _get_user_cached(telegram_id: int) -> dict:
+    rec = _user_cache.get(telegram_id)
+    if rec and monotonic() - rec[0] < _USER_CACHE_TTL:
+        return rec[1]
+    user = await get_user_by_telegram_id(telegram_id)
+    if len(_user_cache) > 10_000:
+        _user_cache.clear()
+    _user_cache[telegram_id] = (monotonic(), user)
+    return user
+
 # ============= LOCALIZATION =============
 
 TEXTS = {
@@ -68,20 +119,55 @@ Ilovani oching va kiring!""",
 }
 
 
-def tr(lang: str, key: str, **kwargs) -> str:
-    """Get translated text with optional formatting"""
-    text = TEXTS.get(lang, TEXTS["ru"]).get(key, TEXTS["ru"].get(key, ""))
-    if kwargs:
-        return text.format(**kwargs)
+# Плоский словарь (lang, key) -> text с уже применённым фоллбэком на
+# русский: tr() зовётся на каждое сообщение, и одна выборка по хэшу
+# дешевле трёх вложенных .get
+_FLAT_TEXTS = {}
+for _lang, _d in TEXTS.items():
+    for _key, _default in TEXTS["ru"].items():
+        _FLAT_TEXTS[(_lang, _key)] = _d.get(_key, _default)
+del _lang, _d, _key, _default
+
+
+def tr(lang: str, key: str) -> str:
+    """Get translated text (pure dict lookup, no formatting)"""
+    text = _FLAT_TEXTS.get((lang, key))
+    if text is None:
+        text = TEXTS["ru"].get(key, "")
     return text
 
 
+def trf(lang: str, key: str, **kwargs) -> str:
+    """Get translated text with placeholders filled in"""
+    return tr(lang, key).format_map(kwargs)
+
+
+# Самая длинная строка модуля — достаём её напрямую, минуя общий tr()
+_REG_COMPLETE = {_lang: _FLAT_TEXTS[(_lang, "registration_complete")] for _lang in TEXTS}
+
+
+# Кнопка «Открыть приложение» — по экземпляру на язык, URL читается из
+# конфига один раз на импорте, а не через os.getenv в обработчике
+_OPEN_APP_KB = {
+    _lang: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
+            text=tr(_lang, "open_app"),
+            web_app=WebAppInfo(url=WEBAPP_URL)
+        )]
+    ])
+    for _lang in TEXTS
+}
+
+
 # ============= /START COMMAND =============
 
 @router.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     """Main entry point - check if user exists or start registration"""
-    user = await get_user_by_telegram_id(message.from_user.id)
+    if _start_is_duplicate(message.from_user.id):
+        return
+
+    user = await _get_user_cached(message.from_user.id)
     
     if user:
         # User exists - show main menu
@@ -106,8 +192,8 @@ async def process_language(callback: types.CallbackQuery, state: FSMContext):
     lang = callback.data.split("_")[1]
     await state.update_data(language=lang)
     
-    await callback.message.delete()
-    await callback.message.answer(
+    # Один edit вместо delete + answer — вдвое меньше вызовов API
+    await callback.message.edit_text(
         tr(lang, "welcome_new"),
         parse_mode="Markdown"
     )
@@ -116,13 +202,17 @@ async def process_language(callback: types.CallbackQuery, state: FSMContext):
 
 # ============= NICKNAME INPUT =============
 
+# Выбрасываем пробельные символы одним C-проходом вместо strip + replace;
+# lower() остаётся отдельно — таблица не накрыла бы кириллицу
+_NICK_TT = str.maketrans({c: None for c in " \t\r\n"})
+
 @router.message(RegistrationState.waiting_for_nickname)
 async def process_nickname(message: types.Message, state: FSMContext):
     """Handle nickname input"""
     data = await state.get_data()
     lang = data.get("language", "ru")
     
-    nickname = message.text.strip().lower().replace(" ", "")
+    nickname = message.text.translate(_NICK_TT).lower()
     
     # Validate length
     if len(nickname) < 3:
@@ -137,7 +227,7 @@ async def process_nickname(message: types.Message, state: FSMContext):
     # Nickname is good - save and ask for password
     await state.update_data(nickname=nickname)
     await message.answer(
-        tr(lang, "nickname_ok", nickname=nickname),
+        trf(lang, "nickname_ok", nickname=nickname),
         parse_mode="Markdown"
     )
     await state.set_state(RegistrationState.waiting_for_password)
@@ -159,39 +249,40 @@ async def process_password(message: types.Message, state: FSMContext):
         await message.answer(tr(lang, "password_short"))
         return
     
-    # Delete the password message for security
+    # Delete the password message for security; удаление не обязано
+    # задерживать регистрацию — прячем его RTT за записью в базу
+    task = asyncio.create_task(_silent_delete(message))
+    _bg_tasks.add(task)
+    task.add_done_callback(_bg_tasks.discard)
+
+    if message.from_user.id in _reg_inflight:
+        return
+    _reg_inflight.add(message.from_user.id)
     try:
-        await message.delete()
-    except:
-        pass
-    
-    # Register user in database
-    result = await register_user_via_bot(
-        telegram_id=message.from_user.id,
-        nickname=nickname,
-        password=password,
-        language=lang
-    )
-    
+        # Register user in database
+        result = await register_user_via_bot(
+            telegram_id=message.from_user.id,
+            nickname=nickname,
+            password=password,
+            language=lang
+        )
+    finally:
+        _reg_inflight.discard(message.from_user.id)
+
     if result.get("error"):
         await message.answer(f"❌ Ошибка: {result['error']}")
         return
-    
-    # Build open app button
-    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
-    import os
-    webapp_url = os.getenv("WEBAPP_URL", "https://localhost:8080")
-    
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(
-            text=tr(lang, "open_app"),
-            web_app=WebAppInfo(url=webapp_url)
-        )]
-    ])
-    
+
+    # Пока шла регистрация, в кэше лежал None — сбрасываем
+    _user_cache.pop(message.from_user.id, None)
+
+    kb = _OPEN_APP_KB.get(lang, _OPEN_APP_KB["ru"])
+
     # Send completion message with copyable credentials
     await message.answer(
-        tr(lang, "registration_complete", nickname=nickname, password=password),
+        _REG_COMPLETE.get(lang, _REG_COMPLETE["ru"]).format_map(
+            {"nickname": nickname, "password": password}
+        ),
         parse_mode="Markdown",
         reply_markup=kb
     )
@@ -205,7 +296,7 @@ async def process_password(message: types.Message, state: FSMContext):
 @router.message(Command("seller_code"))
 async def cmd_seller_code(message: types.Message):
     """Generate seller verification code"""
-    user = await get_user_by_telegram_id(message.from_user.id)
+    user = await _get_user_cached(message.from_user.id)
     
     if not user:
         await message.answer("❌ Вы не зарегистрированы. Используйте /start")
@@ -213,11 +304,10 @@ async def cmd_seller_code(message: types.Message):
     
     lang = user.get("language", "ru")
     
-    from bot.database.database import generate_seller_code
     code = await generate_seller_code(message.from_user.id)
     
     await message.answer(
-        tr(lang, "seller_code", code=code),
+        trf(lang, "seller_code", code=code),
         parse_mode="HTML"
     )
 
@@ -225,14 +315,13 @@ async def cmd_seller_code(message: types.Message):
 @router.callback_query(F.data == "get_seller_code")
 async def callback_seller_code(callback: types.CallbackQuery):
     """Button callback for seller code"""
-    user = await get_user_by_telegram_id(callback.from_user.id)
+    user = await _get_user_cached(callback.from_user.id)
     lang = user.get("language", "ru") if user else "ru"
     
-    from bot.database.database import generate_seller_code
     code = await generate_seller_code(callback.from_user.id)
     
     await callback.message.answer(
-        tr(lang, "seller_code", code=code),
+        trf(lang, "seller_code", code=code),
         parse_mode="HTML"
     )
     await callback.answer()
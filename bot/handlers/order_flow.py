@@ -9,6 +9,7 @@ from bot.database.database import (
     update_bid_message_id, get_rejected_bids_with_messages, get_order_client_id
 )
 from config import WEBAPP_URL
+import asyncio
 import logging
 
 router = Router()
@@ -109,7 +110,7 @@ async def start_order_creation(event, state: FSMContext):
     
     # Check if user is registered (has phone in database)
     user = await get_user(user_id)
-    if not user or not user[5]:  # user[5] is phone
+    if not user or not user["phone"]:
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(
                 text="📱 Зарегистрироваться",
@@ -438,8 +439,8 @@ async def submit_bid(event, state: FSMContext, bot: Bot):
     
     # Get exchanger info for rating display
     exchanger = await get_user(user_id)
-    exchanger_name = exchanger[2] if exchanger and exchanger[2] else f"Обменник #{user_id}"
-    rating = exchanger[7] if exchanger and len(exchanger) > 7 and exchanger[7] else 5.0
+    exchanger_name = exchanger["username"] if exchanger and exchanger["username"] else f"Обменник #{user_id}"
+    rating = exchanger["rating"] if exchanger and exchanger["rating"] else 5.0
     
     # Save bid
     bid_id = await place_bid(
@@ -451,15 +452,7 @@ async def submit_bid(event, state: FSMContext, bot: Bot):
     )
     
     await state.clear()
-    
-    await message.answer(
-        f"✅ <b>Предложение отправлено!</b>\n\n"
-        f"📄 Заявка #{data['order_id']}\n"
-        f"💰 Курс: {data['rate']}\n\n"
-        f"Ожидайте ответа клиента. Если он примет ваше предложение - вы получите уведомление.",
-        parse_mode="HTML"
-    )
-    
+
     # Notify client about new bid (Uber-like notification)
     order = data['order']
     client_id = order['user_id']
@@ -490,17 +483,31 @@ async def submit_bid(event, state: FSMContext, bot: Bot):
     
     notify_text += f"\n📄 Заявка #{data['order_id']}"
     
-    try:
-        sent_msg = await bot.send_message(
-            chat_id=client_id,
-            text=notify_text,
-            reply_markup=keyboard,
+    async def _notify_client():
+        try:
+            sent_msg = await bot.send_message(
+                chat_id=client_id,
+                text=notify_text,
+                reply_markup=keyboard,
+                parse_mode="HTML"
+            )
+            # Save message_id for smart deletion later
+            await update_bid_message_id(bid_id, sent_msg.message_id)
+        except Exception as e:
+            logging.error(f"Failed to notify client {client_id}: {e}")
+
+    # Подтверждение обменнику и уведомление клиенту независимы —
+    # отправляем оба HTTPS-вызова параллельно, а не друг за другом
+    await asyncio.gather(
+        message.answer(
+            f"✅ <b>Предложение отправлено!</b>\n\n"
+            f"📄 Заявка #{data['order_id']}\n"
+            f"💰 Курс: {data['rate']}\n\n"
+            f"Ожидайте ответа клиента. Если он примет ваше предложение - вы получите уведомление.",
             parse_mode="HTML"
-        )
-        # Save message_id for smart deletion later
-        await update_bid_message_id(bid_id, sent_msg.message_id)
-    except Exception as e:
-        logging.error(f"Failed to notify client {client_id}: {e}")
+        ),
+        _notify_client(),
+    )
 
 
 # ==================== ACCEPT BID ====================
@@ -522,11 +529,11 @@ async def on_accept_bid(callback: CallbackQuery, bot: Bot):
     exchanger = await get_user(bid['exchanger_id'])
     client = await get_user(client_id)
     
-    exchanger_username = exchanger[2] if exchanger and exchanger[2] else None
+    exchanger_username = exchanger["username"] if exchanger and exchanger["username"] else None
     exchanger_name = exchanger_username or f"Обменник #{bid['exchanger_id']}"
-    exchanger_phone = exchanger[5] if exchanger and len(exchanger) > 5 else None
-    client_phone = client[5] if client and len(client) > 5 else None
-    client_name = client[2] if client and client[2] else f"Клиент #{client_id}"
+    exchanger_phone = exchanger["phone"] if exchanger else None
+    client_phone = client["phone"] if client else None
+    client_name = client["username"] if client and client["username"] else f"Клиент #{client_id}"
     
     # ==== UPDATE CLIENT'S MESSAGE (the one they clicked) ====
     contact_info = f"👤 <b>{exchanger_name}</b>\n"
@@ -628,7 +635,7 @@ async def back_to_menu(callback: CallbackQuery):
     """Go back to main menu"""
     from bot.keyboards.main_menu import get_main_menu_keyboard
     user = await get_user(callback.from_user.id)
-    lang = user[2] if user else "ru"
+    lang = user["language"] if user else "ru"
     
     await callback.message.edit_text(
         "📱 Главное меню:",
@@ -1,28 +1,33 @@
+from functools import lru_cache
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from config import ADMIN_IDS, WEBAPP_URL
 
+_MENU_TEXTS = {
+    "ru": {
+        "rates": "💱 Курсы",
+        "calc": "🧮 Калькулятор",
+        "lang": "🌐 Язык",
+        "admin": "🛠 Админка",
+        "contact": "✉️ Связь",
+        "app": "📱 Открыть NellX",
+    },
+    "uz": {
+        "rates": "💱 Kurslar",
+        "calc": "🧮 Kalkulyator",
+        "lang": "🌐 Til",
+        "admin": "🛠 Admin",
+        "contact": "✉️ Aloqa",
+        "app": "📱 NellX ochish",
+    },
+}
 
-def get_main_menu_keyboard(user_id: int = None, lang: str = "ru"):
-    texts = {
-        "ru": {
-            "rates": "💱 Курсы",
-            "calc": "🧮 Калькулятор",
-            "lang": "🌐 Язык",
-            "admin": "🛠 Админка",
-            "contact": "✉️ Связь",
-            "app": "📱 Открыть NellX",
-        },
-        "uz": {
-            "rates": "💱 Kurslar",
-            "calc": "🧮 Kalkulyator",
-            "lang": "🌐 Til",
-            "admin": "🛠 Admin",
-            "contact": "✉️ Aloqa",
-            "app": "📱 NellX ochish",
-        },
-    }
-
-    t = texts.get(lang, texts["ru"])
+
+# Клавиатура зависит только от (is_admin, lang) — кэшируем готовые
+# иммутабельные pydantic-модели вместо сборки на каждое сообщение
+@lru_cache(maxsize=8)
+def _build_main_menu(is_admin: bool, lang: str) -> InlineKeyboardMarkup:
+    t = _MENU_TEXTS.get(lang, _MENU_TEXTS["ru"])
 
     buttons = [
         [InlineKeyboardButton(text=t["app"], web_app=WebAppInfo(url=WEBAPP_URL))],
@@ -32,12 +37,16 @@ def get_main_menu_keyboard(user_id: int = None, lang: str = "ru"):
          InlineKeyboardButton(text=t["contact"], url="https://t.me/navawiy")],
     ]
 
-    if user_id and user_id in ADMIN_IDS:
+    if is_admin:
         buttons.append([InlineKeyboardButton(text=t["admin"], callback_data="menu_admin")])
 
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def get_main_menu_keyboard(user_id: int = None, lang: str = "ru"):
+    return _build_main_menu(bool(user_id and user_id in ADMIN_IDS), lang)
+
+
 def get_groups_keyboard(
     groups: list,
     selected_groups: list = None,
@@ -55,23 +64,23 @@ def get_groups_keyboard(
     buttons = []
     for group in current_page_groups:
         is_selected = group["id"] in selected_groups
-        
+
         topic_count = 0
         for s in selected_groups:
             if isinstance(s, str) and s.startswith(f"{group['id']}:"):
                 topic_count += 1
-        
+
         type_icon = "📢" if group.get("type") == "channel" else "👥"
         if group.get("is_forum"):
             type_icon = "🏛"
-        
+
         if topic_count > 0:
             text = f"✅ {type_icon} {group['title']} ({topic_count} тем)"
         elif is_selected:
             text = f"✅ {type_icon} {group['title']}"
         else:
             text = f"▫️ {type_icon} {group['title']}"
-            
+
         buttons.append([InlineKeyboardButton(text=text, callback_data=f"{prefix}_{group['id']}_{page}")])
 
     nav_buttons = []
@@ -86,7 +95,7 @@ def get_groups_keyboard(
         InlineKeyboardButton(text="Выбрать все/снять", callback_data=f"{prefix}_all_{page}"),
     ]
     buttons.append(action_buttons)
-    
+
     bottom_row = [
         InlineKeyboardButton(text="🔙 Назад", callback_data="mailing_start"),
         InlineKeyboardButton(text="Готово", callback_data=f"{prefix}s_done"),
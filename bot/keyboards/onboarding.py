@@ -1,45 +1,53 @@
+from functools import lru_cache
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 
+# Статичные клавиатуры — иммутабельные pydantic-модели, собираем один
+# раз на импорте вместо валидации всех полей на каждый запрос
+
+_LANGUAGE_KB = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="Русский 🇷🇺", callback_data="lang_ru")],
+        [InlineKeyboardButton(text="O'zbekcha 🇺🇿", callback_data="lang_uz")],
+    ]
+)
+
+_PHONE_KB = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="📱 Отправить номер / Raqamni yuborish", request_contact=True)],
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=True,
+)
+
+_CODE_KB = InlineKeyboardMarkup(
+    inline_keyboard=[[InlineKeyboardButton(text="🔄 Запросить новый код", callback_data="resend_code")]]
+)
+
 
 def get_language_keyboard():
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Русский 🇷🇺", callback_data="lang_ru")],
-            [InlineKeyboardButton(text="O'zbekcha 🇺🇿", callback_data="lang_uz")],
-        ]
-    )
-    return keyboard
+    return _LANGUAGE_KB
 
 
+@lru_cache(maxsize=4)
 def get_tos_keyboard(tos_url: str):
-    keyboard = InlineKeyboardMarkup(
+    return InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="Принять условия / Qoidalarni qabul qilish", url=tos_url)],
             [InlineKeyboardButton(text="✅ Согласен", callback_data="tos_agree")],
         ]
     )
-    return keyboard
 
 
 def get_phone_keyboard():
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="📱 Отправить номер / Raqamni yuborish", request_contact=True)],
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=True,
-    )
-    return keyboard
+    return _PHONE_KB
 
 
 def get_code_keyboard():
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="🔄 Запросить новый код", callback_data="resend_code")]]
-    )
-    return keyboard
+    return _CODE_KB
 
 
-def get_numpad_keyboard(current_code: str = ""):
+def _build_numpad(with_confirm: bool):
     buttons = [
         [
             InlineKeyboardButton(text="1", callback_data="numpad_1"),
@@ -62,9 +70,18 @@ def get_numpad_keyboard(current_code: str = ""):
         ],
     ]
 
-    if len(current_code) >= 5:
+    if with_confirm:
         buttons.append([InlineKeyboardButton(text="✅ Подтвердить / Tasdiqlash", callback_data="numpad_done")])
 
     buttons.append([InlineKeyboardButton(text="🔄 Запросить новый код", callback_data="resend_code")])
 
     return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+# Раскладка зависит только от того, набрано ли 5+ цифр — два варианта
+_NUMPAD_KB = _build_numpad(False)
+_NUMPAD_CONFIRM_KB = _build_numpad(True)
+
+
+def get_numpad_keyboard(current_code: str = ""):
+    return _NUMPAD_CONFIRM_KB if len(current_code) >= 5 else _NUMPAD_KB
@@ -0,0 +1,79 @@
+"""Общая очередь исходящих Telegram-вызовов с адаптивным token bucket.
+
+Все вызовы бота делят один лимит ~30 сообщений/с. Вместо того чтобы
+каждый обработчик сам ловил 429 и повторял, вызовы ставятся в очередь и
+уходят через общий bucket: на успехах темп плавно растёт к лимиту, на
+TelegramRetryAfter очередь останавливается на указанную паузу, bucket
+сливается и темп режется вдвое.
+"""
+import asyncio
+import logging
+from time import monotonic
+
+from aiogram.exceptions import TelegramRetryAfter
+
+# Стартуем ниже глобального лимита и подползаем к нему на успехах
+_RATE_START = 25.0
+_RATE_MAX = 30.0
+_RATE_STEP = 0.5
+
+_queue: asyncio.Queue | None = None
+_worker_task: asyncio.Task | None = None
+
+
+async def send(coro_factory):
+    """Поставить вызов в очередь и дождаться его результата.
+
+    coro_factory — функция без аргументов, создающая корутину вызова
+    (например, lambda: message.edit_text(...)); фабрика нужна, чтобы
+    вызов можно было повторить после retry_after.
+    """
+    global _queue, _worker_task
+    if _queue is None:
+        _queue = asyncio.Queue()
+        _worker_task = asyncio.create_task(_worker_loop())
+
+    fut = asyncio.get_running_loop().create_future()
+    await _queue.put((coro_factory, fut))
+    return await fut
+
+
+async def _worker_loop():
+    rate = _RATE_START
+    tokens = rate
+    last = monotonic()
+
+    while True:
+        coro_factory, fut = await _queue.get()
+        try:
+            now = monotonic()
+            tokens = min(rate, tokens + (now - last) * rate)
+            last = now
+            if tokens < 1.0:
+                await asyncio.sleep((1.0 - tokens) / rate)
+                tokens = 1.0
+            tokens -= 1.0
+
+            try:
+                result = await coro_factory()
+            except TelegramRetryAfter as e:
+                logging.warning(f"Outbound queue paused {e.retry_after}s by Telegram")
+                await asyncio.sleep(e.retry_after)
+                rate = max(1.0, rate * 0.5)
+                tokens = 0.0
+                try:
+                    result = await coro_factory()
+                except Exception as retry_err:
+                    if not fut.done():
+                        fut.set_exception(retry_err)
+                    continue
+            except Exception as err:
+                if not fut.done():
+                    fut.set_exception(err)
+                continue
+
+            rate = min(_RATE_MAX, rate + _RATE_STEP)
+            if not fut.done():
+                fut.set_result(result)
+        finally:
+            _queue.task_done()
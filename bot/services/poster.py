@@ -19,13 +19,13 @@ async def run_mailing_task(user_id: int, template_id: int, target_groups: list,
     logging.info(f"Starting mailing task for user {user_id}, template {template_id}, groups {len(target_groups)}")
 
     user = await get_user(user_id)
-    if not user or not user[3]:  # session_string
+    if not user or not user["session_string"]:
         logging.error(f"User {user_id} not found or no session")
         if task_id is not None:
             await deactivate_task(task_id)
         return False
 
-    session_string = user[3]
+    session_string = user["session_string"]
     template = await get_template(template_id)
 
     if not template:
@@ -3,7 +3,12 @@ import json
 import logging
 from typing import List
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from bot.database.database import get_scheduled_tasks, update_last_run, deactivate_task
+from bot.database.database import (
+    get_scheduled_tasks,
+    get_scheduled_task_groups,
+    update_last_run,
+    deactivate_task,
+)
 from bot.services.poster import run_mailing_task
 
 scheduler = AsyncIOScheduler()
@@ -73,9 +78,14 @@ def stop_mailing_job(task_id: int):
 
 async def load_scheduled_mailings():
     tasks = await get_scheduled_tasks()
+    # Чаты берём из нормализованной таблицы одним сканом; JSON-колонка
+    # остаётся только как фоллбэк для задач, созданных до миграции
+    groups_map = await get_scheduled_task_groups()
     for task in tasks:
         try:
-            raw_groups = json.loads(task["target_groups"]) if task["target_groups"] else []
+            raw_groups = groups_map.get(task["id"])
+            if raw_groups is None:
+                raw_groups = json.loads(task["target_groups"]) if task["target_groups"] else []
             target_groups = []
             for g in raw_groups:
                 try:
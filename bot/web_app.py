@@ -75,11 +75,7 @@ async def handle_init(request):
     
     user = await get_user(int(user_id))
     if user:
-        try:
-            role = user[6]
-        except IndexError:
-            role = None
-        return web.json_response({'role': role})
+        return web.json_response({'role': user["role"]})
     return web.json_response({'role': None})
 
 @routes.post('/api/role')
@@ -90,9 +86,14 @@ async def handle_set_role(request):
     await update_user_role(int(user_id), role)
     return web.json_response({'status': 'ok'})
 
+import re
 import time
 RATE_LIMITS = {}
 
+# Дешёвая проверка телефона на границе: мусорный ввод отсекается до
+# похода в базу (скомпилирована один раз)
+_PHONE_RE = re.compile(r"^\+?\d{7,15}$")
+
 # ============= NEW AUTH ENDPOINTS =============
 
 @routes.post('/api/auth/check-nickname')
@@ -261,9 +262,8 @@ async def handle_generate_code(request):
     import random
     code = f"{random.randint(100000, 999999)}"
     
-    from bot.database.database import add_user, save_verification_code_by_user
-    await add_user(int(user_id), 'ru')
-    await save_verification_code_by_user(int(user_id), code, f"pending_{user_id}")
+    from bot.database.database import register_and_issue_code
+    await register_and_issue_code(int(user_id), 'ru', code, f"pending_{user_id}")
     
     logging.info(f"Generated code {code} for user {user_id}")
     return web.json_response({'status': 'ok', 'code': code})
@@ -279,9 +279,13 @@ async def handle_update_user(request):
     if not user_id:
         return web.json_response({'error': 'Missing user_id'}, status=400)
 
+    if phone:
+        phone = phone.strip().replace(" ", "")
+        if not _PHONE_RE.match(phone):
+            return web.json_response({'error': 'invalid_phone'}, status=400)
+
     from bot.database.database import update_user_profile
     await update_user_profile(user_id, phone, username, name)
-    await update_user_profile(user_id, phone, username, name)
     return web.json_response({'status': 'ok'})
 
 @routes.post('/api/user/avatar')
@@ -436,8 +440,8 @@ async def handle_place_bid(request):
         order = await get_order(int(data['order_id']))
         exchanger = await get_user(int(data['exchanger_id']))
         
-        exchanger_name = exchanger[2] if exchanger and exchanger[2] else f"Обменник #{data['exchanger_id']}"
-        rating = exchanger[7] if exchanger and len(exchanger) > 7 and exchanger[7] else 5.0
+        exchanger_name = exchanger["username"] if exchanger and exchanger["username"] else f"Обменник #{data['exchanger_id']}"
+        rating = exchanger["rating"] if exchanger and exchanger["rating"] else 5.0
         
         client_id = order['user_id']
         exchanger_id = int(data['exchanger_id'])
@@ -563,12 +567,12 @@ async def handle_accept_bid(request):
     exchanger = await get_user(bid['exchanger_id'])
     
     exchanger_id = bid['exchanger_id']
-    exchanger_name = exchanger[2] if exchanger and exchanger[2] else f"Обменник #{exchanger_id}"
+    exchanger_name = exchanger["username"] if exchanger and exchanger["username"] else f"Обменник #{exchanger_id}"
     
     order_client_id = order['user_id'] if order else (int(client_id) if client_id else None)
     client = await get_user(order_client_id) if order_client_id else None
-    client_name = client[2] if client and client[2] else f"Клиент #{order_client_id}"
-    client_phone = client[5] if client and len(client) > 5 else None
+    client_name = client["username"] if client and client["username"] else f"Клиент #{order_client_id}"
+    client_phone = client["phone"] if client else None
     
     bot = request.app['bot']
     
@@ -817,11 +821,11 @@ async def handle_get_user_profile(request):
     if user:
         return web.json_response({
             'id': user_id,
-            'name': user[2] or 'User',  # username
+            'name': user["username"] or 'User',
             'avatar_url': None,
-            'role': user[6] if len(user) > 6 else 'client',
-            'rating': user[7] if len(user) > 7 else 5.0,
-            'deals_count': user[8] if len(user) > 8 else 0
+            'role': user["role"] or 'client',
+            'rating': user["rating"] or 5.0,
+            'deals_count': user["deals_count"] or 0
         })
     
     # Create basic user data if nothing found
@@ -1,20 +1,40 @@
 import asyncio
 import logging
+import os
 from aiogram import Bot, Dispatcher
 from aiohttp import web
-from bot.database.database import create_tables
+from bot.database.database import create_tables, close_db, rates_agg_refresh_loop, code_purge_loop
 from bot.services.scheduler import scheduler, start_scheduler, load_scheduled_mailings
 from bot.web_app import init_web_app
 from config import BOT_TOKEN
 
 logging.basicConfig(level=logging.INFO)
 
+# uvloop ускоряет каждый await (планирование колбэков в libuv);
+# на Windows или без пакета молча остаёмся на стандартном цикле
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
 
 async def main():
     await create_tables()
 
     bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher()
+
+    # FSM-состояния: с FSM_REDIS_URL переживают рестарт и позволяют
+    # масштабироваться на несколько процессов; без него — MemoryStorage
+    storage = None
+    redis_url = os.getenv("FSM_REDIS_URL")
+    if redis_url:
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+            storage = RedisStorage.from_url(redis_url)
+        except ImportError:
+            logging.warning("FSM_REDIS_URL задан, но пакет redis не установлен — используем MemoryStorage")
+    dp = Dispatcher(storage=storage) if storage else Dispatcher()
 
     # Routers
     from bot.handlers.antispam_menu import router as antispam_menu_router
@@ -42,10 +62,11 @@ async def main():
     # Background jobs
     start_scheduler()
     await load_scheduled_mailings()
+    rates_task = asyncio.create_task(rates_agg_refresh_loop())
+    purge_task = asyncio.create_task(code_purge_loop())
 
     # Start Web App Server
     try:
-        import os
         port = int(os.getenv('PORT', 8080))
         app = await init_web_app(bot)
         runner = web.AppRunner(app)
@@ -69,6 +90,9 @@ async def main():
             break
             
     await bot.session.close()
+    rates_task.cancel()
+    purge_task.cancel()
+    await close_db()
     if scheduler.running:
         scheduler.shutdown(wait=False)
     # Cleanup web app